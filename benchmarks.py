@@ -0,0 +1,254 @@
+"""
+Benchmarks for the graph algorithms. Run all of them with
+
+	python benchmarks.py
+
+or only some of them by passing their names as arguments.
+"""
+import sys
+import math
+import time
+import random
+import threading
+from graph import WeightedGraph, FlowNetwork, euclidean_heuristic, bipartite_matching
+from contractionhierarchy import ContractionHierarchy
+from lowestcommonancestor import LowestCommonAncestor
+from disjointset import DisjointSetArray, DisjointSetConcurrent, sharded_union
+
+def grid_graph(size, storage='map', seed=0):
+	"""
+	Undirected size x size grid with coordinates. Edge weights are the
+	distance between the endpoints times a random factor in [1, 2), so the
+	euclidean heuristic is admissible.
+	"""
+	rng = random.Random(seed)
+	coordinates = {(x, y): (x, y) for x in range(size) for y in range(size)}
+	edges = []
+	for x, y in coordinates:
+		for neighbor in ((x + 1, y), (x, y + 1)):
+			if neighbor in coordinates:
+				edges.append(({(x, y), neighbor}, 1 + rng.random()))
+
+	return WeightedGraph(coordinates, edges, storage=storage), coordinates
+
+def timed(function, *args):
+	start = time.perf_counter()
+	result = function(*args)
+	return result, time.perf_counter() - start
+
+def point_to_point(size=60, queries=20, seed=0):
+	"""Verticies settled per s-t query by the point to point searches"""
+	G, coordinates = grid_graph(size, seed=seed)
+	rng = random.Random(seed)
+	verticies = sorted(G.verticies)
+	pairs = [(rng.choice(verticies), rng.choice(verticies)) for i in range(queries)]
+	heuristic = euclidean_heuristic(coordinates)
+	hierarchy, build_seconds = timed(ContractionHierarchy, G)
+
+	totals = {}
+	def record(name, settled, seconds):
+		count, total = totals.get(name, (0, 0))
+		totals[name] = (count + settled, total + seconds)
+
+	for s, t in pairs:
+		# Plain Dijkstra settles every reachable vertex
+		_, seconds = timed(G._single_source_shortest_paths, s)
+		record('_dijkstra', sum(1 for d in G.shortest_paths.values() if d != math.inf), seconds)
+
+		def early_exit():
+			settled = 0
+			for vertex, distance in G.iter_settled(s):
+				settled += 1
+				if vertex == t:
+					return settled
+		settled, seconds = timed(early_exit)
+		record('early exit', settled, seconds)
+
+		_, seconds = timed(G.bidirectional_shortest_path, s, t)
+		record('bidirectional', G.settled_count, seconds)
+
+		_, seconds = timed(G.a_star, s, t, heuristic)
+		record('A*', G.settled_count, seconds)
+
+		_, seconds = timed(hierarchy.shortest_path, s, t, True)
+		record('hierarchy', hierarchy.settled_count, seconds)
+
+	print("%d x %d grid, %d queries" % (size, size, queries))
+	print("contraction hierarchy built in %.1f s" % (build_seconds))
+	print("%-15s %15s %15s" % ("", "settled/query", "ms/query"))
+	for name, (settled, seconds) in totals.items():
+		print("%-15s %15.1f %15.2f" % (name, settled / queries, 1000 * seconds / queries))
+
+def integer_weights(size=150, queries=5, seed=0):
+	"""Dijkstra's algorithm with each priority queue, on grids with small and
+	large integer weights"""
+	rng = random.Random(seed)
+	for max_weight in (10, 10 ** 6):
+		for storage in ('map', 'csr'):
+			G, coordinates = grid_graph(size, storage, seed)
+			G = WeightedGraph(G.verticies, [(u, v, rng.randint(1, max_weight)) for u, v, w in G.edges],
+				is_directed=True, storage=storage)
+			sources = rng.sample(sorted(G.verticies), queries)
+			print("%d x %d grid, weights up to %d, %s storage" % (size, size, max_weight, storage))
+			# A bucket per distance in a window of max_weight is hopeless for large weights
+			for queue in ('heap', 'dial', 'radix') if max_weight <= G.dial_max_weight else ('heap', 'radix'):
+				G.dijkstra_queue = queue
+				seconds = 0
+				for source in sources:
+					seconds += timed(G._single_source_shortest_paths, source)[1]
+				print("%-15s %12.1f ms/query" % (queue, 1000 * seconds / queries))
+
+def layered_network(layers, width, degree, seed=0):
+	"""
+	Flow network of 'layers' layers of 'width' verticies, every vertex having
+	edges of random integer capacity to 'degree' random verticies of the next
+	layer. The source -1 feeds the first layer and the last layer feeds the
+	sink -2.
+	"""
+	rng = random.Random(seed)
+	verticies = [-1, -2] + [(i, j) for i in range(layers) for j in range(width)]
+	edges = {}
+	for j in range(width):
+		edges[-1, (0, j)] = rng.randint(1, 100)
+		edges[(layers - 1, j), -2] = rng.randint(1, 100)
+	for i in range(layers - 1):
+		for j in range(width):
+			for k in rng.sample(range(width), degree):
+				edges[(i, j), (i + 1, k)] = rng.randint(1, 100)
+
+	return verticies, [(u, v, capacity) for (u, v), capacity in edges.items()]
+
+def max_flow(layers=10, width=40, degree=5, seed=0):
+	"""Time of the max flow algorithms on a layered network"""
+	verticies, edges = layered_network(layers, width, degree, seed)
+	print("%d verticies, %d edges" % (len(verticies), len(edges)))
+	for algorithm in ('edmonds_karp', 'dinic', 'push_relabel'):
+		G = FlowNetwork(verticies, edges, source=-1, sink=-2)
+		flow, seconds = timed(G.max_flow, algorithm)
+		print("%-15s flow %8d %12.1f ms" % (algorithm, flow, 1000 * seconds))
+
+def matching(size=20000, degree=5, seed=0):
+	"""Hopcroft-Karp against Dinic's algorithm on the equivalent flow network"""
+	rng = random.Random(seed)
+	left = [('left', i) for i in range(size)]
+	right = [('right', i) for i in range(size)]
+	edges = set((u, rng.choice(right)) for u in left for i in range(degree))
+	print("%d + %d verticies, %d edges" % (size, size, len(edges)))
+
+	(pairs, cover), seconds = timed(bipartite_matching, left, right, edges)
+	print("%-20s %8d %12.1f ms" % ("hopcroft_karp", len(pairs), 1000 * seconds))
+
+	network_edges = [(u, v, 1) for u, v in edges]
+	network_edges += [('source', u, 1) for u in left] + [(v, 'sink', 1) for v in right]
+	G = FlowNetwork(left + right + ['source', 'sink'], network_edges, source=('source',), sink=('sink',))
+	flow, seconds = timed(G.max_flow, 'dinic')
+	print("%-20s %8d %12.1f ms" % ("dinic", flow, 1000 * seconds))
+
+def minimum_spanning_tree(size=200, seed=0):
+	"""Kruskal's, Prim's and Borůvka's algorithms on a grid"""
+	for storage in ('map', 'csr'):
+		G, coordinates = grid_graph(size, storage, seed)
+		print("%d x %d grid, %s storage" % (size, size, storage))
+		for name in ('kruskal', 'boruvka'):
+			forest, seconds = timed(getattr(G, name))
+			print("%-15s weight %12.2f %12.1f ms" % (name, forest.weight, 1000 * seconds))
+		_, seconds = timed(G.prim, (0, 0))
+		print("%-15s %19s %12.1f ms" % ('prim', '', 1000 * seconds))
+
+def lowest_common_ancestor(size=300, queries=10000, seed=0):
+	"""Batched lowest common ancestor queries on a BFS tree of a grid, against
+	walking the parent pointers"""
+	rng = random.Random(seed)
+	G, coordinates = grid_graph(size, 'csr', seed)
+	G.breadth_first_search((0, 0))
+	parents = G.parents
+	verticies = sorted(G.verticies)
+	verticies1 = [rng.choice(verticies) for i in range(queries)]
+	verticies2 = [rng.choice(verticies) for i in range(queries)]
+
+	def walk():
+		ancestors = []
+		for vertex1, vertex2 in zip(verticies1, verticies2):
+			seen = set()
+			while vertex1 is not None:
+				seen.add(vertex1)
+				vertex1 = parents[vertex1]
+			while vertex2 not in seen:
+				vertex2 = parents[vertex2]
+			ancestors.append(vertex2)
+		return ancestors
+
+	print("%d x %d grid, %d queries" % (size, size, queries))
+	expected, seconds = timed(walk)
+	print("%-15s %12.1f ms" % ("parent walk", 1000 * seconds))
+	index, seconds = timed(LowestCommonAncestor, parents)
+	print("%-15s %12.1f ms" % ("index build", 1000 * seconds))
+	for algorithm in ('sparse_table', 'binary_lifting'):
+		ancestors, seconds = timed(index.query_many, verticies1, verticies2, algorithm)
+		assert ancestors == expected
+		print("%-15s %12.1f ms" % (algorithm, 1000 * seconds))
+
+def union_find(size=200000, pairs=1000000, seed=0):
+	"""Union throughput of the thread-safe and sharded disjoint sets, against
+	a DisjointSetArray behind one global lock, by ids and by keys"""
+	rng = random.Random(seed)
+	ids1 = [rng.randrange(size) for i in range(pairs)]
+	ids2 = [rng.randrange(size) for i in range(pairs)]
+	keys1 = ['key%d' % (i) for i in ids1]
+	keys2 = ['key%d' % (i) for i in ids2]
+
+	def threaded(union, threads, arguments1, arguments2):
+		def work(start):
+			for k in range(start, pairs, threads):
+				union(arguments1[k], arguments2[k])
+		workers = [threading.Thread(target=work, args=(start,)) for start in range(threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+	def global_lock(keyed):
+		D = DisjointSetArray(0 if keyed else size)
+		lock = threading.Lock()
+		def union_ids(i, j):
+			with lock:
+				root1, root2 = D.find_id(i), D.find_id(j)
+				if root1 != root2:
+					D.union(root1, root2)
+		def union(key1, key2):
+			with lock:
+				for key in (key1, key2):
+					if key not in D.key_to_id:
+						D.new_set(key)
+				root1, root2 = D.find(key1), D.find(key2)
+				if root1 != root2:
+					D.union(root1, root2)
+		return union if keyed else union_ids
+
+	def report(name, count, unit, seconds):
+		print("%-20s %2d %-9s %10.0f unions/s" % (name, count, unit, pairs / seconds))
+
+	print("%d ids, %d unions" % (size, pairs))
+	for count in (1, 2, 4, 8):
+		report("global lock ids", count, "threads", timed(threaded, global_lock(False), count, ids1, ids2)[1])
+		report("lock striped ids", count, "threads",
+			timed(threaded, DisjointSetConcurrent(size).union_ids, count, ids1, ids2)[1])
+		report("global lock keys", count, "threads", timed(threaded, global_lock(True), count, keys1, keys2)[1])
+		report("lock striped keys", count, "threads",
+			timed(threaded, DisjointSetConcurrent().union, count, keys1, keys2)[1])
+		report("sharded", count, "processes", timed(sharded_union, size, ids1, ids2, count)[1])
+
+BENCHMARKS = {
+	'point_to_point': point_to_point,
+	'integer_weights': integer_weights,
+	'max_flow': max_flow,
+	'matching': matching,
+	'minimum_spanning_tree': minimum_spanning_tree,
+	'lowest_common_ancestor': lowest_common_ancestor,
+	'union_find': union_find,
+}
+
+if __name__ == '__main__':
+	for name in sys.argv[1:] or BENCHMARKS:
+		BENCHMARKS[name]()
+		print()
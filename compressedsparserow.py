@@ -0,0 +1,300 @@
+from array import array
+from collections.abc import MutableMapping, Set
+import numpy as np
+
+# Marks a slot of a VertexMap whose vertex is not a key of the map
+ABSENT = object()
+
+def _to_array(typecode, values):
+	"""Copies a NumPy array into an array.array of the given typecode"""
+	result = array(typecode)
+	result.frombytes(values.tobytes())
+	return result
+
+class CSRAdjacency:
+	"""Compressed sparse row adjacency structure.
+
+	Every vertex is given a dense integer id (its index in 'verticies'). The
+	neighbors of the vertex with id i are neighbors[offsets[i]:offsets[i + 1]],
+	and if the graph is weighted, weights[k] is the weight of the edge ending
+	at neighbors[k]. Indexing with a vertex returns a lightweight view of its
+	row, so code written against the adjacency map of Graph keeps working.
+	"""
+	def __init__(self, verticies=(), edges=(), weighted=False):
+		"""
+		verticies - any iterable containing hashable objects
+		edges - (u,v) tuples, or (u,v,weight) tuples if weighted
+		"""
+		self.verticies = list(verticies)
+		self.vertex_to_id = {vertex: i for i, vertex in enumerate(self.verticies)}
+		self.weighted = weighted
+
+		sources = array('q')
+		targets = array('q')
+		edge_weights = []
+		for edge in edges:
+			assert edge[0] in self.vertex_to_id, "Undefined vertex: %s" % (edge[0],)
+			assert edge[1] in self.vertex_to_id, "Undefined vertex: %s" % (edge[1],)
+			sources.append(self.vertex_to_id[edge[0]])
+			targets.append(self.vertex_to_id[edge[1]])
+			if weighted:
+				edge_weights.append(edge[2])
+
+		self._sort_edges(sources, targets, edge_weights)
+
+	@classmethod
+	def from_edge_ids(cls, verticies, sources, targets, weights=None):
+		"""Builds the CSR arrays from parallel sequences of the source id,
+		target id (and weight) of every edge, ids being positions in verticies."""
+		csr = cls.__new__(cls)
+		csr.verticies = list(verticies)
+		csr.vertex_to_id = {vertex: i for i, vertex in enumerate(csr.verticies)}
+		csr.weighted = weights is not None
+		csr._sort_edges(sources, targets, weights)
+		return csr
+
+	def _sort_edges(self, sources, targets, edge_weights):
+		n = len(self.verticies)
+		sources = np.asarray(sources, dtype=np.int64)
+		targets = np.asarray(targets, dtype=np.int64)
+		if self.weighted:
+			# Keep integer weights as integers so results match the map backend
+			typecode = getattr(edge_weights, 'typecode', None)
+			weights = np.asarray(edge_weights)
+			if typecode is None:
+				typecode = 'q' if not len(weights) or weights.dtype.kind in 'iub' else 'd'
+			weights = weights.astype(np.int64 if typecode == 'q' else np.float64)
+
+		# Repeated edges are kept once, as in the sets and dicts of the map
+		# backend: where the edge first appeared, with the weight it was last given
+		keys = sources * n + targets
+		_, first = np.unique(keys, return_index=True)
+		if len(first) < len(keys):
+			_, last = np.unique(keys[::-1], return_index=True)
+			unique_order = np.argsort(first)
+			first = first[unique_order]
+			sources, targets = sources[first], targets[first]
+			if self.weighted:
+				weights = weights[len(keys) - 1 - last[unique_order]]
+
+		# Stable, so the edges of a vertex keep their order
+		order = np.argsort(sources, kind='stable')
+		offsets = np.zeros(n + 1, dtype=np.int64)
+		np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+
+		self.offsets = _to_array('q', offsets)
+		self.neighbors = _to_array('q', targets[order])
+		self.weights = _to_array(typecode, weights[order]) if self.weighted else None
+
+	@classmethod
+	def from_arrays(cls, verticies, offsets, neighbors, weights=None):
+		"""Wraps already built CSR arrays (any indexable sequences of ints, e.g.
+		arrays or memoryviews) without copying them."""
+		csr = cls.__new__(cls)
+		csr.verticies = list(verticies)
+		csr.vertex_to_id = {vertex: i for i, vertex in enumerate(csr.verticies)}
+		csr.weighted = weights is not None
+		csr.offsets = offsets
+		csr.neighbors = neighbors
+		csr.weights = weights
+		return csr
+
+	def __len__(self):
+		return len(self.verticies)
+
+	@property
+	def number_of_edges(self):
+		return len(self.neighbors)
+
+	def id(self, vertex):
+		return self.vertex_to_id[vertex]
+
+	def row(self, i):
+		"""Returns the (start, end) slice of 'neighbors' belonging to id i"""
+		return self.offsets[i], self.offsets[i + 1]
+
+	def edge_sources(self):
+		"""Source id of every edge, aligned with 'neighbors'"""
+		sources = array('q')
+		offsets = self.offsets
+		for u in range(len(self.verticies)):
+			sources.extend([u] * (offsets[u + 1] - offsets[u]))
+		return sources
+
+	def __getitem__(self, vertex):
+		i = self.vertex_to_id.get(vertex)
+		if self.weighted:
+			return CSRWeightedRow(self, i)
+		return CSRRow(self, i)
+
+	def __contains__(self, vertex):
+		return vertex in self.vertex_to_id
+
+	def __iter__(self):
+		return iter(self.verticies)
+
+	def items(self):
+		for vertex in self.verticies:
+			yield vertex, self[vertex]
+
+	def __repr__(self):
+		return "CSRAdjacency(V: %d, E: %d)" % (len(self.verticies), len(self.neighbors))
+
+class CSRRow:
+	"""View of the neighbors of one vertex. A vertex without an id (not in the
+	graph) has an empty row, like a missing key of a defaultdict(set)."""
+	def __init__(self, csr, i):
+		self.csr = csr
+		if i is None:
+			self.start = self.end = 0
+		else:
+			self.start, self.end = csr.offsets[i], csr.offsets[i + 1]
+
+	def _ids(self):
+		return self.csr.neighbors[self.start:self.end]
+
+	def __iter__(self):
+		verticies = self.csr.verticies
+		for j in self._ids():
+			yield verticies[j]
+
+	def __len__(self):
+		return self.end - self.start
+
+	def __contains__(self, vertex):
+		j = self.csr.vertex_to_id.get(vertex)
+		return j is not None and j in self._ids()
+
+	def __repr__(self):
+		return str(set(self))
+
+class CSRWeightedRow(CSRRow):
+	"""View of the neighbors of one vertex and the weights of the edges to
+	them; behaves like the read-only dict {neighbor: weight}."""
+	def _index(self, vertex):
+		j = self.csr.vertex_to_id.get(vertex)
+		if j is not None:
+			neighbors = self.csr.neighbors
+			for k in range(self.start, self.end):
+				if neighbors[k] == j:
+					return k
+		return None
+
+	def __getitem__(self, vertex):
+		k = self._index(vertex)
+		if k is None:
+			raise KeyError(vertex)
+		return self.csr.weights[k]
+
+	def get(self, vertex, default=None):
+		k = self._index(vertex)
+		return default if k is None else self.csr.weights[k]
+
+	def items(self):
+		verticies = self.csr.verticies
+		weights = self.csr.weights
+		neighbors = self.csr.neighbors
+		for k in range(self.start, self.end):
+			yield verticies[neighbors[k]], weights[k]
+
+	def keys(self):
+		return iter(self)
+
+	def values(self):
+		return iter(self.csr.weights[self.start:self.end])
+
+	def __repr__(self):
+		return str(dict(self.items()))
+
+class CSREdges(Set):
+	"""Read-only set of the edges of a CSRAdjacency, as (u,v) tuples or
+	(u,v,weight) tuples if it is weighted. Graphs built straight from CSR
+	arrays use it instead of materializing a set of tuples."""
+	def __init__(self, csr):
+		self.csr = csr
+
+	def __iter__(self):
+		csr = self.csr
+		verticies, offsets, neighbors, weights = csr.verticies, csr.offsets, csr.neighbors, csr.weights
+		for u, vertex in enumerate(verticies):
+			for k in range(offsets[u], offsets[u + 1]):
+				if weights is None:
+					yield vertex, verticies[neighbors[k]]
+				else:
+					yield vertex, verticies[neighbors[k]], weights[k]
+
+	def __len__(self):
+		return self.csr.number_of_edges
+
+	def __contains__(self, edge):
+		if edge[0] not in self.csr:
+			return False
+		row = self.csr[edge[0]]
+		if self.csr.weighted:
+			return len(edge) == 3 and row.get(edge[1], ABSENT) == edge[2]
+		return len(edge) == 2 and edge[1] in row
+
+	@classmethod
+	def _from_iterable(cls, iterable):
+		# Results of set operators are plain sets of edge tuples
+		return set(iterable)
+
+	def __repr__(self):
+		return "CSREdges(%d)" % (len(self))
+
+class VertexMap(MutableMapping):
+	"""Vertex keyed mapping stored as a list indexed by the vertex ids of a
+	CSRAdjacency. The CSR engines of Graph work on 'values_by_id' directly
+	with integer ids; everything else sees an ordinary mapping.
+
+	Missing keys read as 'default' (without being inserted), mirroring the
+	defaultdicts used by the map backend. If ids is True, the stored values
+	are vertex ids (e.g. parents) and are translated back to vertices.
+	"""
+	def __init__(self, csr, values=None, default=None, ids=False):
+		self.csr = csr
+		self.values_by_id = [ABSENT] * len(csr) if values is None else values
+		self.default = default
+		self.ids = ids
+
+	def __getitem__(self, vertex):
+		i = self.csr.vertex_to_id.get(vertex)
+		if i is None:
+			return self.default
+		value = self.values_by_id[i]
+		if value is ABSENT:
+			return self.default
+		if self.ids and value is not None:
+			return self.csr.verticies[value]
+		return value
+
+	def get(self, vertex, default=None):
+		return self[vertex] if vertex in self else default
+
+	def __setitem__(self, vertex, value):
+		i = self.csr.vertex_to_id[vertex]
+		if self.ids and value is not None:
+			value = self.csr.vertex_to_id[value]
+		self.values_by_id[i] = value
+
+	def __delitem__(self, vertex):
+		i = self.csr.vertex_to_id[vertex]
+		if self.values_by_id[i] is ABSENT:
+			raise KeyError(vertex)
+		self.values_by_id[i] = ABSENT
+
+	def __contains__(self, vertex):
+		i = self.csr.vertex_to_id.get(vertex)
+		return i is not None and self.values_by_id[i] is not ABSENT
+
+	def __iter__(self):
+		verticies = self.csr.verticies
+		for i, value in enumerate(self.values_by_id):
+			if value is not ABSENT:
+				yield verticies[i]
+
+	def __len__(self):
+		return sum(1 for value in self.values_by_id if value is not ABSENT)
+
+	def __repr__(self):
+		return "VertexMap(%s)" % (dict(self.items()))
@@ -0,0 +1,265 @@
+import math
+import heapq
+import pickle
+from array import array
+
+class ContractionHierarchy:
+	"""
+	Preprocessed index for repeated shortest path queries on a static graph
+	with non-negative weights.
+
+	Verticies are contracted one at a time, least important first. Contracting
+	v removes it from the remaining graph and adds a shortcut u->x (through v)
+	for every path u->v->x that no other path of the remaining graph is as
+	short as. The rank of a vertex is the order it was contracted in. A query
+	then runs a bidirectional Dijkstra that only follows edges towards higher
+	ranked verticies, which settles very few verticies.
+
+	The upward edges are stored as CSR arrays (see compressedsparserow.py),
+	so an index can be saved to disk and loaded by other processes without
+	being rebuilt.
+	"""
+
+	# The local searches that look for paths making a shortcut unnecessary
+	# give up after settling this many verticies. Giving up early only adds
+	# superfluous shortcuts.
+	witness_settle_limit = 64
+
+	def __init__(self, graph):
+		"""
+		graph - WeightedGraph (either storage) with non-negative weights
+		"""
+		assert not graph.negative_edges, "Contraction hierarchies need non-negative weights"
+
+		self.verticies = list(graph.verticies)
+		self.vertex_to_id = {vertex: i for i, vertex in enumerate(self.verticies)}
+
+		n = len(self.verticies)
+		# Remaining graph: out_edges[u][v] = in_edges[v][u] = weight
+		out_edges = [{} for i in range(n)]
+		in_edges = [{} for i in range(n)]
+		# The vertex a shortcut u->v goes through
+		middles = {}
+		for vertex1, vertex2, weight in graph.edges:
+			u, v = self.vertex_to_id[vertex1], self.vertex_to_id[vertex2]
+			if u != v and weight < out_edges[u].get(v, math.inf):
+				out_edges[u][v] = weight
+				in_edges[v][u] = weight
+
+		self._contract(out_edges, in_edges, middles)
+
+	def _contract(self, out_edges, in_edges, middles):
+		n = len(self.verticies)
+		self.rank = array('q', [0] * n)
+		# Edges of every vertex to verticies contracted after it:
+		# upward[u] = [(v, weight, middle)] for edges u->v and
+		# downward[u] = [(v, weight, middle)] for edges v->u
+		upward = [None] * n
+		downward = [None] * n
+		contracted_neighbors = [0] * n
+
+		def priority(v):
+			# Edge difference plus how many neighbors are gone already, which
+			# spreads the contraction evenly over the graph
+			shortcuts = self._shortcuts(v, out_edges, in_edges)
+			return len(shortcuts) - len(out_edges[v]) - len(in_edges[v]) + contracted_neighbors[v]
+
+		to_be_processed = [(priority(v), v) for v in range(n)]
+		heapq.heapify(to_be_processed)
+		rank = 0
+		while to_be_processed:
+			old_priority, v = heapq.heappop(to_be_processed)
+			# Lazy updates: priorities only grow stale by contracting neighbors
+			new_priority = priority(v)
+			if to_be_processed and new_priority > to_be_processed[0][0]:
+				heapq.heappush(to_be_processed, (new_priority, v))
+				continue
+
+			for u, x, weight in self._shortcuts(v, out_edges, in_edges):
+				if weight < out_edges[u].get(x, math.inf):
+					out_edges[u][x] = weight
+					in_edges[x][u] = weight
+					middles[u, x] = v
+
+			upward[v] = [(x, weight, middles.get((v, x), -1)) for x, weight in out_edges[v].items()]
+			downward[v] = [(u, weight, middles.get((u, v), -1)) for u, weight in in_edges[v].items()]
+			for x in out_edges[v]:
+				del in_edges[x][v]
+				contracted_neighbors[x] += 1
+			for u in in_edges[v]:
+				del out_edges[u][v]
+				contracted_neighbors[u] += 1
+			out_edges[v] = in_edges[v] = None
+
+			self.rank[v] = rank
+			rank += 1
+
+		self.upward = self._to_csr(upward)
+		self.downward = self._to_csr(downward)
+
+	def _shortcuts(self, v, out_edges, in_edges):
+		"""Shortcuts (u, x, weight) needed if v were contracted now"""
+		shortcuts = []
+		if not out_edges[v]:
+			return shortcuts
+		longest_out = max(out_edges[v].values())
+
+		for u, weight_in in in_edges[v].items():
+			targets = set(out_edges[v]) - {u}
+			if not targets:
+				continue
+			witness = self._witness_search(u, v, weight_in + longest_out, set(targets), out_edges)
+			for x in targets:
+				weight = weight_in + out_edges[v][x]
+				if witness.get(x, math.inf) > weight:
+					shortcuts.append((u, x, weight))
+
+		return shortcuts
+
+	def _witness_search(self, source, skipped, limit, targets, out_edges):
+		"""Dijkstra from source in the remaining graph without 'skipped',
+		up to distance limit or until every target is settled"""
+		distances = {source: 0}
+		settled = set()
+		to_be_processed = [(0, source)]
+		while to_be_processed and len(settled) < self.witness_settle_limit:
+			d, u = heapq.heappop(to_be_processed)
+			if u in settled:
+				continue
+			if d > limit:
+				break
+			settled.add(u)
+			targets.discard(u)
+			if not targets:
+				break
+			for v, weight in out_edges[u].items():
+				if v != skipped and d + weight < distances.get(v, math.inf):
+					distances[v] = d + weight
+					heapq.heappush(to_be_processed, (d + weight, v))
+
+		return distances
+
+	@staticmethod
+	def _to_csr(rows):
+		offsets = array('q', [0])
+		targets = array('q')
+		weights = array('d')
+		middles = array('q')
+		for row in rows:
+			for v, weight, middle in row:
+				targets.append(v)
+				weights.append(weight)
+				middles.append(middle)
+			offsets.append(len(targets))
+
+		return offsets, targets, weights, middles
+
+	def shortest_path(self, starting_vertex, ending_vertex, return_path=False):
+		"""
+		Distance from starting_vertex to ending_vertex (math.inf if there is
+		no path), or (distance, path) if return_path. self.settled_count is
+		the number of verticies the two searches settled.
+		"""
+		s = self.vertex_to_id[starting_vertex]
+		t = self.vertex_to_id[ending_vertex]
+
+		# Both searches only go up the hierarchy
+		searches = (self.upward, self.downward)
+		distances = ({s: 0}, {t: 0})
+		parents = ({s: -1}, {t: -1})
+		to_be_processed = ([(0, s)], [(0, t)])
+		settled = (set(), set())
+
+		best = math.inf
+		meeting = -1
+		side = 0
+		while to_be_processed[0] or to_be_processed[1]:
+			# Alternate between the searches, skipping one that is finished
+			if not to_be_processed[side]:
+				side = 1 - side
+			d, u = heapq.heappop(to_be_processed[side])
+			if u in settled[side]:
+				continue
+			if d >= best:
+				# Nothing left in this search can improve on best
+				to_be_processed[side].clear()
+				continue
+			settled[side].add(u)
+
+			if u in distances[1 - side] and d + distances[1 - side][u] < best:
+				best = d + distances[1 - side][u]
+				meeting = u
+
+			offsets, targets, weights, _ = searches[side]
+			for k in range(offsets[u], offsets[u + 1]):
+				v = targets[k]
+				if d + weights[k] < distances[side].get(v, math.inf):
+					distances[side][v] = d + weights[k]
+					parents[side][v] = u
+					heapq.heappush(to_be_processed[side], (d + weights[k], v))
+			side = 1 - side
+
+		self.settled_count = len(settled[0]) + len(settled[1])
+		if not return_path:
+			return best
+		if best == math.inf:
+			return best, None
+
+		# Hierarchy edges from s up to the meeting vertex, then down to t
+		hops = []
+		u = meeting
+		while parents[0][u] != -1:
+			hops.append((parents[0][u], u))
+			u = parents[0][u]
+		hops.reverse()
+		u = meeting
+		while parents[1][u] != -1:
+			hops.append((u, parents[1][u]))
+			u = parents[1][u]
+
+		path = [s]
+		for u, v in hops:
+			path.extend(self._unpack(u, v))
+		return best, [self.verticies[u] for u in path]
+
+	def _unpack(self, u, v):
+		"""Original verticies after u on the hierarchy edge u->v"""
+		path = []
+		stack = [(u, v)]
+		while stack:
+			u, v = stack.pop()
+			middle = self._middle(u, v)
+			if middle == -1:
+				path.append(v)
+			else:
+				# Both halves of a shortcut go down to the middle vertex
+				stack.append((middle, v))
+				stack.append((u, middle))
+		return path
+
+	def _middle(self, u, v):
+		# The edge is stored with whichever endpoint was contracted first
+		if self.rank[u] < self.rank[v]:
+			offsets, targets, _, middles = self.upward
+			start, end, other = offsets[u], offsets[u + 1], v
+		else:
+			offsets, targets, _, middles = self.downward
+			start, end, other = offsets[v], offsets[v + 1], u
+
+		for k in range(start, end):
+			if targets[k] == other:
+				return middles[k]
+		raise KeyError((self.verticies[u], self.verticies[v]))
+
+	def save(self, path):
+		with open(path, 'wb') as file:
+			pickle.dump((self.verticies, self.rank, self.upward, self.downward), file,
+				protocol=pickle.HIGHEST_PROTOCOL)
+
+	@classmethod
+	def load(cls, path):
+		hierarchy = cls.__new__(cls)
+		with open(path, 'rb') as file:
+			hierarchy.verticies, hierarchy.rank, hierarchy.upward, hierarchy.downward = pickle.load(file)
+		hierarchy.vertex_to_id = {vertex: i for i, vertex in enumerate(hierarchy.verticies)}
+		return hierarchy
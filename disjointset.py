@@ -1,3 +1,9 @@
+from array import array
+from collections import defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import numpy as np
 from profilehooks import profile
 
 class DisjointSetList:
@@ -89,12 +95,13 @@ class DisjointSet:
 			raise KeyError("Key not found in any set: %s" % (key))
 		node = self.key_to_object[key]
 
-		def _find(node):
-			if node != node.parent:
-				node.parent = _find(node.parent)
-			return node.parent
-
-		return _find(node)
+		root = node
+		while root != root.parent:
+			root = root.parent
+		# Path compression
+		while node != root:
+			node.parent, node = root, node.parent
+		return root
 
 	def union(self, root1, root2):
 		if root1.rank > root2.rank:
@@ -113,4 +120,485 @@ class TreeNode:
 		self.rank = 0
 
 	def __repr__(self):
-		return "<TreeNode(key: %s)>" % (self.key)
\ No newline at end of file
+		return "<TreeNode(key: %s)>" % (self.key)
+
+class DisjointSetArray:
+	"""
+	Disjoint sets of the integer ids 0..n-1 kept in flat arrays: parent[i]
+	is the parent of i in its set's tree and size[r] the size of the set of
+	root r. find halves paths and union links the smaller tree below the
+	larger one. Keys are mapped to ids only by new_set and find; everything
+	else works on ids, and find_many/union_many take NumPy arrays of them.
+	"""
+	def __init__(self, size=0):
+		"""size - number of singleton sets (ids 0..size-1) to start with"""
+		self.parent = array('i', range(size))
+		self.size = array('i', [1]) * size
+		self.number_of_sets = size
+		self.key_to_id = {}
+
+	def __len__(self):
+		return len(self.parent)
+
+	def new_set(self, key):
+		"""Adds the singleton set of key and returns its id"""
+		assert key not in self.key_to_id, "Keys must be distinct"
+		i = len(self.parent)
+		self.parent.append(i)
+		self.size.append(1)
+		self.number_of_sets += 1
+		self.key_to_id[key] = i
+		return i
+
+	def find(self, key):
+		"""Root id of the set of key"""
+		if key not in self.key_to_id:
+			raise KeyError("Key not found in any set: %s" % (key))
+		return self.find_id(self.key_to_id[key])
+
+	def find_id(self, i):
+		parent = self.parent
+		while parent[i] != i:
+			# Path halving: point every other vertex on the path at its grandparent
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	def union(self, root1, root2):
+		"""Merges the sets of two distinct roots, returns the new root"""
+		size = self.size
+		if size[root1] < size[root2]:
+			root1, root2 = root2, root1
+		self.parent[root2] = root1
+		size[root1] += size[root2]
+		self.number_of_sets -= 1
+		return root1
+
+	def find_many(self, ids):
+		"""Root id of every id in the array, halving all their paths"""
+		parent = np.frombuffer(self.parent, dtype=np.int32)
+		roots = np.array(ids, dtype=np.int32)
+		while True:
+			up = parent[roots]
+			moving = up != roots
+			if not moving.any():
+				return roots
+			grandparents = parent[up]
+			parent[roots[moving]] = grandparents[moving]
+			roots = np.where(moving, grandparents, roots)
+
+	def union_many(self, ids1, ids2):
+		"""
+		Merges the sets of ids1[i] and ids2[i] for every i, returns the number
+		of merges. Each round links every root paired with a larger root
+		(ties broken by id, so links can't form a cycle) below one of them,
+		then repeats for the pairs still in different sets.
+		"""
+		parent = np.frombuffer(self.parent, dtype=np.int32)
+		size = np.frombuffer(self.size, dtype=np.int32)
+		roots1, roots2 = self.find_many(ids1), self.find_many(ids2)
+		merges = 0
+		while True:
+			apart = roots1 != roots2
+			roots1, roots2 = roots1[apart], roots2[apart]
+			if not roots1.size:
+				break
+
+			larger = (size[roots1] > size[roots2]) | ((size[roots1] == size[roots2]) & (roots1 > roots2))
+			lower = np.where(larger, roots2, roots1)
+			upper = np.where(larger, roots1, roots2)
+			# A root paired with several others is linked below the first
+			lower, first = np.unique(lower, return_index=True)
+			upper = upper[first]
+			parent[lower] = upper
+			# Links can chain, so add the sizes of the linked roots to the
+			# roots they now end at
+			np.add.at(size, self.find_many(upper), size[lower])
+			merges += len(lower)
+
+			roots1, roots2 = self.find_many(roots1), self.find_many(roots2)
+
+		self.number_of_sets -= merges
+		return merges
+
+	def merge(self, other):
+		"""Unions in every set of other, a DisjointSetArray over the same ids.
+		Returns the number of merges."""
+		assert len(other) == len(self), "Both must have the same ids"
+		parent = np.frombuffer(other.parent, dtype=np.int32)
+		linked = np.flatnonzero(parent != np.arange(len(parent)))
+		return self.union_many(linked, parent[linked])
+
+class DisjointSetConcurrent:
+	"""
+	DisjointSetArray that threads can share. find only ever points an id at
+	one of its ancestors, which stays correct whatever other threads do, so
+	it takes no lock. union locks the stripes of the two roots it links
+	(lower stripe first, so threads can't deadlock), checks that both are
+	still roots and otherwise retries with the new roots.
+	"""
+	def __init__(self, size=0, stripes=64):
+		"""
+		size - number of singleton sets (ids 0..size-1) to start with
+		stripes - number of locks; root r is guarded by lock r % stripes
+		"""
+		self.parent = array('i', range(size))
+		self.size = array('i', [1]) * size
+		self.key_to_id = {}
+		self.locks = [Lock() for i in range(stripes)]
+		# Unions made under each lock, only changed while holding it
+		self.merges = [0] * stripes
+		self.new_set_lock = Lock()
+
+	def __len__(self):
+		return len(self.parent)
+
+	@property
+	def number_of_sets(self):
+		return len(self.parent) - sum(self.merges)
+
+	def new_set(self, key):
+		"""Adds the singleton set of key if it has none, returns its id"""
+		# Only adding a key needs the lock
+		i = self.key_to_id.get(key)
+		if i is not None:
+			return i
+		with self.new_set_lock:
+			i = self.key_to_id.get(key)
+			if i is None:
+				i = len(self.parent)
+				self.parent.append(i)
+				self.size.append(1)
+				self.key_to_id[key] = i
+			return i
+
+	def find(self, key):
+		"""Root id of the set of key"""
+		if key not in self.key_to_id:
+			raise KeyError("Key not found in any set: %s" % (key))
+		return self.find_id(self.key_to_id[key])
+
+	def find_id(self, i):
+		parent = self.parent
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	def union(self, key1, key2):
+		"""Joins the sets of two keys, adding sets for new keys. Returns
+		False if they were already in the same set."""
+		return self.union_ids(self.new_set(key1), self.new_set(key2))
+
+	def union_ids(self, i, j):
+		parent, size, locks = self.parent, self.size, self.locks
+		while True:
+			root1, root2 = self.find_id(i), self.find_id(j)
+			if root1 == root2:
+				return False
+
+			stripe1, stripe2 = sorted((root1 % len(locks), root2 % len(locks)))
+			with locks[stripe1], locks[stripe2] if stripe2 != stripe1 else nullcontext():
+				# Another thread linked one of them in the meantime
+				if parent[root1] != root1 or parent[root2] != root2:
+					continue
+				if size[root1] < size[root2]:
+					root1, root2 = root2, root1
+				parent[root2] = root1
+				size[root1] += size[root2]
+				self.merges[stripe1] += 1
+				return True
+
+def _shard_forest(size, ids1, ids2):
+	D = DisjointSetArray(size)
+	D.union_many(ids1, ids2)
+	return D
+
+def sharded_union(size, ids1, ids2, workers):
+	"""
+	DisjointSetArray of the ids 0..size-1 with the sets of ids1[i] and
+	ids2[i] joined for every i. The pairs are split between a pool of
+	'workers' processes that each build their own forest, and the forests
+	are merged as they come back.
+	"""
+	D = DisjointSetArray(size)
+	shards = zip(np.array_split(np.asarray(ids1), workers), np.array_split(np.asarray(ids2), workers))
+	with ProcessPoolExecutor(workers) as executor:
+		futures = [executor.submit(_shard_forest, size, shard1, shard2) for shard1, shard2 in shards]
+		for future in futures:
+			D.merge(future.result())
+	return D
+
+class DisjointSetRollback:
+	"""
+	Disjoint sets of the integer ids 0..n-1 whose unions can be undone.
+	Unions link by rank and find doesn't compress paths, so every union only
+	changes the parent of one root (and maybe the rank of another) and is
+	undone by popping it off a stack. Trees stay O(log n) deep.
+	"""
+	def __init__(self, size=0):
+		"""size - number of singleton sets (ids 0..size-1) to start with"""
+		self.parent = array('i', range(size))
+		self.rank = array('b', bytes(size))
+		self.number_of_sets = size
+		self.key_to_id = {}
+		# (linked root, root it was linked below, whether that one's rank grew)
+		self.history = []
+
+	def __len__(self):
+		return len(self.parent)
+
+	def new_set(self, key):
+		"""Adds the singleton set of key and returns its id"""
+		assert key not in self.key_to_id, "Keys must be distinct"
+		i = len(self.parent)
+		self.parent.append(i)
+		self.rank.append(0)
+		self.number_of_sets += 1
+		self.key_to_id[key] = i
+		return i
+
+	def find(self, key):
+		"""Root id of the set of key"""
+		if key not in self.key_to_id:
+			raise KeyError("Key not found in any set: %s" % (key))
+		return self.find_id(self.key_to_id[key])
+
+	def find_id(self, i):
+		parent = self.parent
+		while parent[i] != i:
+			i = parent[i]
+		return i
+
+	def union(self, root1, root2):
+		"""Merges the sets of two distinct roots, returns the new root"""
+		rank = self.rank
+		if rank[root1] < rank[root2]:
+			root1, root2 = root2, root1
+		self.parent[root2] = root1
+		grew = rank[root1] == rank[root2]
+		if grew:
+			rank[root1] += 1
+		self.number_of_sets -= 1
+		self.history.append((root2, root1, grew))
+		return root1
+
+	def snapshot(self):
+		"""Marker of the current state for rollback"""
+		return len(self.history)
+
+	def rollback(self, snapshot=None):
+		"""Undoes the unions made since snapshot (by default, the last one)"""
+		history = self.history
+		if snapshot is None:
+			snapshot = len(history) - 1
+		assert 0 <= snapshot <= len(history), "Invalid snapshot"
+		while len(history) > snapshot:
+			root2, root1, grew = history.pop()
+			self.parent[root2] = root2
+			if grew:
+				self.rank[root1] -= 1
+			self.number_of_sets += 1
+
+def offline_connectivity(events):
+	"""
+	Answers connectivity queries over a log of edge insertions and deletions
+	in O(q log q log n). events is a sequence of ('add', u, v), ('remove', u, v)
+	and ('query', u, v) tuples for undirected edges (an edge added twice must
+	be removed twice); returns whether u and v are connected at each query,
+	in order.
+
+	Every edge is alive during an interval of queries, which a segment tree
+	over the queries splits into O(log q) nodes. A depth first walk of the
+	tree unions the edges of each node on the way down and rolls them back
+	on the way up, so at a leaf the sets are those of the graph at that
+	query.
+	"""
+	D = DisjointSetRollback()
+	def id_of(vertex):
+		i = D.key_to_id.get(vertex)
+		return D.new_set(vertex) if i is None else i
+
+	queries = []
+	# (u, v) -> query indices at which the copies of the edge were added
+	added = defaultdict(list)
+	intervals = []
+	for kind, vertex1, vertex2 in events:
+		u, v = id_of(vertex1), id_of(vertex2)
+		if kind == 'query':
+			queries.append((u, v))
+			continue
+		edge = (min(u, v), max(u, v))
+		if kind == 'add':
+			added[edge].append(len(queries))
+		elif kind == 'remove':
+			assert added[edge], "Edge removed without being added: %s" % ((vertex1, vertex2),)
+			intervals.append((added[edge].pop(), len(queries), edge))
+		else:
+			raise ValueError("Unknown event: %s" % (kind))
+	for edge, starts in added.items():
+		for start in starts:
+			intervals.append((start, len(queries), edge))
+
+	# Bottom up segment tree: leaf size + i is query i, node k covers the
+	# leaves of nodes 2k and 2k + 1
+	size = 1
+	while size < len(queries):
+		size *= 2
+	node_edges = defaultdict(list)
+	for start, end, edge in intervals:
+		low, high = start + size, end + size
+		while low < high:
+			if low & 1:
+				node_edges[low].append(edge)
+				low += 1
+			if high & 1:
+				high -= 1
+				node_edges[high].append(edge)
+			low >>= 1
+			high >>= 1
+
+	answers = [None] * len(queries)
+	# (node, snapshot to roll back to when leaving it, or -1 when entering)
+	to_be_visited = [(1, -1)]
+	while to_be_visited:
+		node, snapshot = to_be_visited.pop()
+		if snapshot >= 0:
+			D.rollback(snapshot)
+			continue
+		# Leftmost query under node; subtrees past the last query are empty
+		first = node
+		while first < size:
+			first *= 2
+		if first - size >= len(queries):
+			continue
+
+		snapshot = D.snapshot()
+		for u, v in node_edges.get(node, ()):
+			root1, root2 = D.find_id(u), D.find_id(v)
+			if root1 != root2:
+				D.union(root1, root2)
+
+		if node >= size:
+			u, v = queries[node - size]
+			answers[node - size] = D.find_id(u) == D.find_id(v)
+			D.rollback(snapshot)
+		else:
+			to_be_visited.append((node, snapshot))
+			to_be_visited.append((2 * node + 1, -1))
+			to_be_visited.append((2 * node, -1))
+
+	return answers
+
+class InconsistentDifference(Exception):
+	pass
+
+class DisjointSetWeighted:
+	"""
+	Disjoint sets whose members carry a value and a potential. Every root
+	keeps the size, sum, minimum and maximum of the values of its set, which
+	union combines in O(1). A union(a, b, difference) also records that
+	potential(b) - potential(a) == difference: potential[i] is kept relative
+	to the parent of i and summed along the path by find, so difference(a, b)
+	reads off any implied difference without visiting the set's members.
+	With a modulus, potentials are taken modulo it (2 for parity constraints).
+	"""
+	def __init__(self, modulus=None):
+		self.modulus = modulus
+		self.key_to_id = {}
+		self.parent = array('i')
+		self.size = array('i')
+		self.potential = []
+		self.total = []
+		self.minimum = []
+		self.maximum = []
+		self.number_of_sets = 0
+
+	def __len__(self):
+		return len(self.parent)
+
+	def new_set(self, key, value=0):
+		"""Adds the singleton set of key, whose member has value"""
+		assert key not in self.key_to_id, "Keys must be distinct"
+		i = len(self.parent)
+		self.key_to_id[key] = i
+		self.parent.append(i)
+		self.size.append(1)
+		self.potential.append(0)
+		self.total.append(value)
+		self.minimum.append(value)
+		self.maximum.append(value)
+		self.number_of_sets += 1
+		return i
+
+	def _id(self, key):
+		if key not in self.key_to_id:
+			raise KeyError("Key not found in any set: %s" % (key))
+		return self.key_to_id[key]
+
+	def find(self, key):
+		"""Root id of the set of key"""
+		return self._find_id(self._id(key))
+
+	def _find_id(self, i):
+		parent, potential = self.parent, self.potential
+		path = []
+		while parent[i] != i:
+			path.append(i)
+			i = parent[i]
+		root = i
+
+		# Path compression: potentials become relative to the root
+		relative = 0
+		for j in reversed(path):
+			relative = self._reduce(relative + potential[j])
+			potential[j] = relative
+			parent[j] = root
+		return root
+
+	def _reduce(self, potential):
+		return potential if self.modulus is None else potential % self.modulus
+
+	def union(self, key1, key2, difference=0):
+		"""
+		Joins the sets of key1 and key2, recording that potential(key2) -
+		potential(key1) == difference. Returns False if they were already in
+		the same set, raises InconsistentDifference if that set implies
+		another difference.
+		"""
+		i, j = self._id(key1), self._id(key2)
+		root1, root2 = self._find_id(i), self._find_id(j)
+		# potential(root2) - potential(root1)
+		offset = self._reduce(difference + self.potential[i] - self.potential[j])
+		if root1 == root2:
+			if offset != 0:
+				raise InconsistentDifference("%s and %s already differ by %s, not %s"
+					% (key1, key2, self.difference(key1, key2), difference))
+			return False
+
+		if self.size[root1] < self.size[root2]:
+			root1, root2 = root2, root1
+			offset = self._reduce(-offset)
+		self.parent[root2] = root1
+		self.potential[root2] = offset
+		self.size[root1] += self.size[root2]
+		self.total[root1] += self.total[root2]
+		self.minimum[root1] = min(self.minimum[root1], self.minimum[root2])
+		self.maximum[root1] = max(self.maximum[root1], self.maximum[root2])
+		self.number_of_sets -= 1
+		return True
+
+	def difference(self, key1, key2):
+		"""potential(key2) - potential(key1), None if they are in different sets"""
+		i, j = self._id(key1), self._id(key2)
+		if self._find_id(i) != self._find_id(j):
+			return None
+		return self._reduce(self.potential[j] - self.potential[i])
+
+	def component_size(self, key):
+		return self.size[self.find(key)]
+
+	def component_aggregate(self, key):
+		"""(sum, minimum, maximum) of the values in the set of key"""
+		root = self.find(key)
+		return self.total[root], self.minimum[root], self.maximum[root]
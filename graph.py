@@ -1,25 +1,441 @@
 import math
-from collections import defaultdict
+import heapq
+import pickle
+import struct
+from array import array
+from mmap import mmap as memory_map, ACCESS_READ
+from collections import defaultdict, OrderedDict, deque
+from collections.abc import Mapping, Set
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 from heap import heap
-from disjointset import DisjointSet
+from disjointset import DisjointSet, DisjointSetArray
+from compressedsparserow import CSRAdjacency, CSREdges, VertexMap, ABSENT
 from profilehooks import profile
 
 class NegativeCycleException(Exception):
-	def __init__(self, negative_cycle_verticies):
+	def __init__(self, negative_cycle_verticies, cycle=None):
+		"""cycle - the verticies of the cycle in order along its edges, if known"""
 		super().__init__("Graph contains a negative cycle: %s" % (negative_cycle_verticies))
 		self.negative_cycle_verticies = negative_cycle_verticies
+		self.cycle = cycle
 
 class NoPathFound(Exception):
 	pass
 
+class InfeasibleFlow(Exception):
+	pass
+
+class VertexPairMatrix(Mapping):
+	"""
+	(vertex1, vertex2) keyed view of a V x V distance matrix whose rows and
+	columns are indexed like 'verticies'. Looking up a pair reads the matrix
+	directly, so no V^2 dict has to be built. If 'sources' is given, the
+	matrix only has a row for each of them (a block of the full matrix).
+
+	predecessors[i,j] is the index of the vertex before j on a shortest path
+	from i to j, or -1 if there is none.
+	"""
+	def __init__(self, verticies, distances, predecessors=None, sources=None):
+		self.verticies = verticies
+		self.vertex_index = {vertex: i for i, vertex in enumerate(verticies)}
+		self.sources = verticies if sources is None else sources
+		self.source_index = self.vertex_index if sources is None else \
+			{vertex: i for i, vertex in enumerate(sources)}
+		self.distances = distances
+		self.predecessors = predecessors
+
+	def __getitem__(self, pair):
+		vertex1, vertex2 = pair
+		return self.distances[self.source_index[vertex1], self.vertex_index[vertex2]].item()
+
+	def __iter__(self):
+		for vertex1 in self.sources:
+			for vertex2 in self.verticies:
+				yield vertex1, vertex2
+
+	def __len__(self):
+		return len(self.sources) * len(self.verticies)
+
+	def path(self, vertex1, vertex2):
+		"""Verticies on a shortest path from vertex1 to vertex2"""
+		assert self.predecessors is not None, "No predecessor matrix was computed"
+		assert self.sources is self.verticies, "Paths need the full matrix"
+		i, j = self.vertex_index[vertex1], self.vertex_index[vertex2]
+		if self.distances[i, j] == math.inf:
+			raise NoPathFound
+
+		path = [j]
+		while j != i:
+			j = self.predecessors[i, j]
+			# Only possible when a negative cycle corrupted the matrix
+			assert len(path) <= len(self.verticies) and j != -1, "Graph contains a negative cycle"
+			path.append(j)
+
+		return [self.verticies[k] for k in reversed(path)]
+
+class EdgeFlows(Mapping):
+	"""
+	(vertex1, vertex2) keyed view of the flow of every edge of a FlowNetwork.
+	The flow of edge i is the residual capacity of its reverse arc 2i + 1,
+	so it is read straight from the residual array instead of a dict.
+	"""
+	def __init__(self, edges, residual_capacity):
+		self.edge_index = {edge: i for i, edge in enumerate(edges)}
+		self.residual_capacity = residual_capacity
+
+	def __getitem__(self, edge):
+		return self.residual_capacity[2 * self.edge_index[edge] + 1]
+
+	def __iter__(self):
+		return iter(self.edge_index)
+
+	def __len__(self):
+		return len(self.edge_index)
+
+class SpanningForest(Set):
+	"""
+	Edges of a minimum spanning forest as parallel arrays: edge i joins
+	verticies[sources[i]] and verticies[targets[i]] with weight weights[i].
+	Iterating yields (vertex1, vertex2, weight) tuples, so it still compares
+	equal to a set of edge tuples.
+	"""
+	def __init__(self, verticies, sources, targets, weights):
+		self.verticies = verticies
+		self.sources = np.asarray(sources, dtype=np.int64)
+		self.targets = np.asarray(targets, dtype=np.int64)
+		self.weights = np.asarray(weights)
+		self._edge_set = None
+
+	@property
+	def weight(self):
+		"""Total weight of the forest"""
+		return self.weights.sum().item()
+
+	def __iter__(self):
+		verticies = self.verticies
+		for u, v, weight in zip(self.sources.tolist(), self.targets.tolist(), self.weights.tolist()):
+			yield verticies[u], verticies[v], weight
+
+	def __len__(self):
+		return len(self.sources)
+
+	def __contains__(self, edge):
+		if self._edge_set is None:
+			self._edge_set = set(self)
+		return edge in self._edge_set
+
+	@classmethod
+	def _from_iterable(cls, iterable):
+		# Results of set operators are plain sets of edge tuples
+		return set(iterable)
+
+	def __repr__(self):
+		return "SpanningForest(E: %d, weight: %s)" % (len(self), self.weight)
+
+def _boruvka_ids(n, sources, targets, weights):
+	"""
+	Borůvka's algorithm over NumPy arrays of edge ids. Every round, each
+	component picks its cheapest edge to another component, ties broken by
+	edge index so the picked edges can't close a cycle, and the components
+	it joins are merged, at least halving their number. Components are kept
+	as an array of labels, merged by pointer jumping. Returns the indices of
+	the forest's edges.
+	"""
+	component = np.arange(n)
+	edges = np.flatnonzero(sources != targets)
+	forest = [np.zeros(0, dtype=np.int64)]
+	while edges.size:
+		ends1 = component[sources[edges]]
+		ends2 = component[targets[edges]]
+		external = ends1 != ends2
+		edges, ends1, ends2 = edges[external], ends1[external], ends2[external]
+		if not edges.size:
+			break
+
+		# Every edge is a candidate of the components at both of its ends
+		ends = np.concatenate((ends1, ends2))
+		candidates = np.concatenate((edges, edges))
+		order = np.lexsort((candidates, weights[candidates], ends))
+		ends, candidates = ends[order], candidates[order]
+		first = np.ones(len(ends), dtype=bool)
+		first[1:] = ends[1:] != ends[:-1]
+		roots, cheapest = ends[first], candidates[first]
+
+		# Hook every component onto the one across its cheapest edge. Two
+		# components picking the same edge point at each other, so the
+		# smaller one stays a root.
+		other = component[sources[cheapest]]
+		other = np.where(other == roots, component[targets[cheapest]], other)
+		link = np.arange(n)
+		link[roots] = other
+		mutual = (link[other] == roots) & (roots < other)
+		link[roots[mutual]] = roots[mutual]
+		while True:
+			jumped = link[link]
+			if np.array_equal(jumped, link):
+				break
+			link = jumped
+		component = link[component]
+		forest.append(np.unique(cheapest))
+
+	return np.concatenate(forest)
+
+def _dijkstra_ids(offsets, neighbors, weights, source, distances, parents):
+	"""
+	Dijkstra over the integer ids of CSR arrays. distances and parents are
+	lists indexed by id, initialized to infinity/None, updated in place.
+	"""
+	settled = bytearray(len(offsets) - 1)
+	distances[source] = 0
+
+	# (distance, id) pairs; stale entries are skipped when popped
+	to_be_processed = [(0, source)]
+	while to_be_processed:
+		d, u = heapq.heappop(to_be_processed)
+		if settled[u]:
+			continue
+		settled[u] = 1
+		for k in range(offsets[u], offsets[u + 1]):
+			v = neighbors[k]
+			if distances[v] > d + weights[k]:
+				distances[v] = d + weights[k]
+				parents[v] = u
+				heapq.heappush(to_be_processed, (distances[v], v))
+
+def _dial(adjacent, source, distances, parents, max_weight):
+	"""
+	Dijkstra with Dial's bucket queue, for integer weights in [0, max_weight].
+	adjacent(u) gives the (v, weight) pairs of the edges leaving u; distances
+	and parents are updated in place (dicts keyed by vertex or lists indexed
+	by id). Tentative distances are in the cyclic window [d, d + max_weight],
+	so bucket d % (max_weight + 1) holds the verticies at distance d.
+	"""
+	size = max_weight + 1
+	buckets = [[] for i in range(size)]
+	distances[source] = 0
+	buckets[0].append(source)
+	pending = 1
+	d = 0
+	while pending:
+		bucket = buckets[d % size]
+		while bucket:
+			u = bucket.pop()
+			pending -= 1
+			# Stale entry of a vertex that got closer since
+			if distances[u] != d:
+				continue
+			for v, weight in adjacent(u):
+				if d + weight < distances[v]:
+					distances[v] = d + weight
+					parents[v] = u
+					buckets[(d + weight) % size].append(v)
+					pending += 1
+		d += 1
+
+def _radix_heap(adjacent, source, distances, parents, max_distance):
+	"""
+	Dijkstra with a radix heap, for non-negative integer weights. Same
+	arguments as _dial, max_distance bounding every distance. An entry with
+	key k is in bucket (k ^ last).bit_length(), last being the last key
+	popped, so buckets only have to be redistributed when bucket 0 is empty.
+	"""
+	buckets = [[] for i in range(max_distance.bit_length() + 1)]
+	distances[source] = 0
+	buckets[0].append((0, source))
+	pending = 1
+	last = 0
+	while pending:
+		if not buckets[0]:
+			i = 1
+			while not buckets[i]:
+				i += 1
+			entries = buckets[i]
+			buckets[i] = []
+			last = min(entries, key=itemgetter(0))[0]
+			for entry in entries:
+				buckets[(entry[0] ^ last).bit_length()].append(entry)
+
+		d, u = buckets[0].pop()
+		pending -= 1
+		if distances[u] != d:
+			continue
+		for v, weight in adjacent(u):
+			if d + weight < distances[v]:
+				distances[v] = d + weight
+				parents[v] = u
+				buckets[(d + weight ^ last).bit_length()].append((d + weight, v))
+				pending += 1
+
+def _spfa(verticies, adjacent, distances, parents):
+	"""
+	Queue based Bellman-Ford (SPFA): only the edges leaving verticies whose
+	distance changed are relaxed, starting from every vertex at a finite
+	distance. adjacent, distances and parents are as for _dial.
+
+	A negative cycle shows up as a cycle of parent pointers, so the parents
+	are checked once every len(verticies) relaxations, which keeps the
+	checks to O(1) amortized per relaxation. Returns the verticies of a
+	negative cycle (see _parent_cycle), or None.
+	"""
+	n = len(verticies)
+	to_be_processed = deque(u for u in verticies if distances[u] != math.inf)
+	queued = set(to_be_processed)
+	relaxations = 0
+	while to_be_processed:
+		u = to_be_processed.popleft()
+		queued.discard(u)
+		d = distances[u]
+		for v, weight in adjacent(u):
+			if d + weight < distances[v]:
+				distances[v] = d + weight
+				parents[v] = u
+				relaxations += 1
+				if relaxations % n == 0:
+					cycle = _parent_cycle(verticies, parents)
+					if cycle:
+						return cycle
+				if v not in queued:
+					queued.add(v)
+					to_be_processed.append(v)
+
+	return None
+
+def _bellman_ford_passes(verticies, adjacent, distances, parents):
+	"""
+	Bellman-Ford in passes over every edge, stopping early after a pass that
+	changes nothing. Same arguments and result as _spfa.
+	"""
+	n = len(verticies)
+	# Pass n only runs if there is a negative cycle
+	for i in range(n):
+		changed = None
+		for u in verticies:
+			d = distances[u]
+			# Relaxing out of an unreached vertex never changes anything
+			if d == math.inf:
+				continue
+			for v, weight in adjacent(u):
+				if d + weight < distances[v]:
+					distances[v] = d + weight
+					parents[v] = u
+					changed = v
+		if changed is None:
+			return None
+
+	# Still changing in pass n: n parents back from the last vertex that
+	# changed is a vertex of the cycle
+	u = changed
+	for i in range(n):
+		u = parents[u]
+	return _parent_cycle([u], parents)
+
+def _parent_cycle(verticies, parents):
+	"""
+	Cycle of parent pointers reachable from 'verticies', as its verticies in
+	the order of the edges between them, or None. Each vertex is walked
+	over at most once, so this is O(V).
+	"""
+	walk = {}
+	for i, vertex in enumerate(verticies):
+		u = vertex
+		while u is not None and u not in walk:
+			walk[u] = i
+			u = parents[u]
+		# The walk started at vertex ran into itself
+		if u is not None and walk[u] == i:
+			cycle = [u]
+			v = parents[u]
+			while v != u:
+				cycle.append(v)
+				v = parents[v]
+			cycle.reverse()
+			return cycle
+
+	return None
+
+def _bellman_ford_ids(offsets, neighbors, weights, distances, parents):
+	"""
+	SPFA over the integer ids of CSR arrays, updating distances and parents
+	(lists indexed by id) in place. Returns the ids of a negative cycle, as
+	a list in order along the cycle, or None.
+	"""
+	def adjacent(u):
+		return zip(neighbors[offsets[u]:offsets[u + 1]], weights[offsets[u]:offsets[u + 1]])
+
+	return _spfa(range(len(offsets) - 1), adjacent, distances, parents)
+
+# Reweighted CSR arrays of the graph in the worker processes of a parallel
+# Johnson run, attached from shared memory by _attach_johnson_graph
+_johnson_graph = None
+
+def _attach_johnson_graph(name, n, m):
+	global _johnson_graph
+	block = shared_memory.SharedMemory(name=name)
+	buffer = block.buf
+	offsets = buffer[:8 * (n + 1)].cast('q')
+	neighbors = buffer[8 * (n + 1):8 * (n + 1 + m)].cast('q')
+	weights = buffer[8 * (n + 1 + m):8 * (n + 1 + 2 * m)].cast('d')
+	h = buffer[8 * (n + 1 + 2 * m):8 * (2 * n + 1 + 2 * m)].cast('d')
+	# The block has to stay open as long as the views are used
+	_johnson_graph = (block, offsets, neighbors, weights, h)
+
+def _johnson_row(source, graph=None):
+	"""Distances from source in the original weights, as an array('d') by id"""
+	block, offsets, neighbors, weights, h = graph or _johnson_graph
+	n = len(offsets) - 1
+	distances = [math.inf] * n
+	_dijkstra_ids(offsets, neighbors, weights, source, distances, [None] * n)
+	return array('d', (distance - h[source] + h[v] for v, distance in enumerate(distances)))
+
+def euclidean_heuristic(coordinates):
+	"""
+	A* heuristic for graphs whose edge weights are at least the straight line
+	distance between their endpoints. coordinates maps every vertex to a
+	tuple of numbers.
+	"""
+	def heuristic(vertex, target):
+		return math.dist(coordinates[vertex], coordinates[target])
+	return heuristic
+
 class Graph:
-	def __init__(self, verticies=(), edges=(), is_directed=False):
+	# Adjacency storage: 'map' (dict of sets/dicts) or 'csr' (compressed sparse row)
+	storage = 'map'
+	csr = None
+	# Whether edges carry a weight as their third element
+	weighted = False
+
+	# Header of the files written by save: magic, format version, flags
+	# (1: directed, 2: acyclic), weight typecode (b'\0' if unweighted), number
+	# of verticies, number of edges, length of the pickled verticies
+	_file_header = struct.Struct('<4sHBcqqq')
+
+	# State kept by the incremental mutation methods, built on first use.
+	# Vertex -> position in a topological order (directed acyclic graphs)
+	_topological_order = None
+	# Vertex -> set of verticies with an edge into it (directed acyclic graphs)
+	_predecessors = None
+	# DisjointSet of connected components (undirected acyclic graphs)
+	_components = None
+
+	# multi_source_breadth_first_search runs a plain BFS per source when
+	# given fewer sources than this
+	bit_parallel_min_sources = 8
+
+	def __init__(self, verticies=(), edges=(), is_directed=False, storage='map'):
 		"""
 		verticies - any iterable containing hashable objects
 		edges - any iterable containing sets or tuples of length 2. Every element
 		of the constituent sets/tuples must be in 'verticies'.
+		storage - 'map' or 'csr'. 'csr' maps the verticies to dense integer ids
+		and keeps the edges in flat arrays, which is far more compact for large
+		graphs and lets the search algorithms run on integer ids.
 		"""
+		assert storage in ('map', 'csr'), "Unknown storage: %s" % (storage)
 		self.is_directed = is_directed
+		self.storage = storage
 
 		edges = self._convert_set_to_tuples(edges)
 
@@ -32,7 +448,147 @@ class Graph:
 
 		self.is_acyclic = self._is_acyclic()
 
+	@classmethod
+	def _from_csr(cls, csr, is_directed, is_acyclic=None):
+		"""Graph with the csr storage around already built CSR arrays. Its edges
+		are a CSREdges view, turned into a set if the graph is modified."""
+		graph = cls.__new__(cls)
+		graph.is_directed = is_directed
+		graph.storage = 'csr'
+		graph.verticies = set(csr.verticies)
+		graph.edges = CSREdges(csr)
+		graph._use_csr(csr)
+		graph._reset_attributes()
+		graph.is_acyclic = graph._is_acyclic() if is_acyclic is None else is_acyclic
+		return graph
+
+	@classmethod
+	def from_edges(cls, edges, verticies=(), is_directed=False):
+		"""
+		Builds a graph with the csr storage from an iterable of (u,v) tuples,
+		or (u,v,weight) for a WeightedGraph, consumed once; an undirected edge
+		is given once. Verticies get ids as they first appear (after the ones
+		in 'verticies', which can add isolated verticies), and the edges go
+		straight into arrays, so no set of edge tuples is built.
+		"""
+		vertex_to_id = {}
+		for vertex in verticies:
+			vertex_to_id.setdefault(vertex, len(vertex_to_id))
+
+		sources = array('q')
+		targets = array('q')
+		weights = array('q') if cls.weighted else None
+		for edge in edges:
+			u = vertex_to_id.setdefault(edge[0], len(vertex_to_id))
+			v = vertex_to_id.setdefault(edge[1], len(vertex_to_id))
+			sources.append(u)
+			targets.append(v)
+			if not is_directed:
+				sources.append(v)
+				targets.append(u)
+			if cls.weighted:
+				weight = edge[2]
+				if weights.typecode == 'q' and not isinstance(weight, int):
+					weights = array('d', weights)
+				weights.append(weight)
+				if not is_directed:
+					weights.append(weight)
+
+		csr = CSRAdjacency.from_edge_ids(vertex_to_id, sources, targets, weights)
+		return cls._from_csr(csr, is_directed)
+
+	@classmethod
+	def read_edge_list(cls, path, is_directed=False, vertex_type=int):
+		"""
+		Streams a text file of 'u v' lines ('u v weight' for a WeightedGraph)
+		into from_edges. Blank lines and lines starting with # are skipped.
+		"""
+		def edges():
+			with open(path) as file:
+				for line in file:
+					fields = line.split()
+					if not fields or fields[0].startswith('#'):
+						continue
+					edge = (vertex_type(fields[0]), vertex_type(fields[1]))
+					if cls.weighted:
+						try:
+							edge += (int(fields[2]),)
+						except ValueError:
+							edge += (float(fields[2]),)
+					yield edge
+
+		return cls.from_edges(edges(), is_directed=is_directed)
+
+	def save(self, path):
+		"""
+		Writes the graph to a flat binary file: a header, the pickled list of
+		verticies (the position of a vertex being its id), then the CSR
+		offsets, neighbors and weights as raw 8 byte arrays in native byte
+		order. load() can memory-map it.
+		"""
+		csr = self.csr if self.storage == 'csr' else CSRAdjacency(self.verticies, self.edges, self.weighted)
+		verticies = pickle.dumps(csr.verticies, protocol=pickle.HIGHEST_PROTOCOL)
+		flags = (1 if self.is_directed else 0) | (2 if self.is_acyclic else 0)
+		typecode = b'\0'
+		if self.weighted:
+			typecode = getattr(csr.weights, 'typecode', None) or csr.weights.format
+			typecode = typecode.encode()
+
+		with open(path, 'wb') as file:
+			file.write(self._file_header.pack(b'GRPH', 1, flags, typecode,
+				len(csr), csr.number_of_edges, len(verticies)))
+			file.write(verticies)
+			# Keep the arrays 8 byte aligned
+			file.write(bytes(-len(verticies) % 8))
+			file.write(csr.offsets)
+			file.write(csr.neighbors)
+			if self.weighted:
+				file.write(csr.weights)
+
+	@classmethod
+	def load(cls, path, mmap=True):
+		"""
+		Reads a graph written by save, with the csr storage. With mmap, the
+		arrays are read-only views of the memory-mapped file: nothing but the
+		verticies is copied, and every process loading the file shares its
+		pages. Otherwise they are read into arrays.
+		"""
+		with open(path, 'rb') as file:
+			if mmap:
+				buffer = memory_map(file.fileno(), 0, access=ACCESS_READ)
+			else:
+				buffer = file.read()
+
+		magic, version, flags, typecode, n, m, length = cls._file_header.unpack_from(buffer)
+		assert magic == b'GRPH' and version == 1, "Not a graph file: %s" % (path)
+		assert (typecode != b'\0') == cls.weighted, \
+		"%s can't load a%s graph" % (cls.__name__, " weighted" if typecode != b'\0' else "n unweighted")
+
+		position = cls._file_header.size
+		verticies = pickle.loads(buffer[position:position + length])
+		position += length + (-length % 8)
+
+		view = memoryview(buffer)
+		def read(typecode, count):
+			nonlocal position
+			data = view[position:position + 8 * count].cast(typecode)
+			position += 8 * count
+			if not mmap:
+				data = array(typecode, data.tobytes())
+			return data
+
+		offsets = read('q', n + 1)
+		neighbors = read('q', m)
+		weights = read(typecode.decode(), m) if cls.weighted else None
+
+		csr = CSRAdjacency.from_arrays(verticies, offsets, neighbors, weights)
+		return cls._from_csr(csr, bool(flags & 1), bool(flags & 2))
+
 	def breadth_first_search(self, starting_vertex):
+		if self.storage == 'csr':
+			self._csr_breadth_first_search(starting_vertex)
+			return
+
 		self.distance_from_start = defaultdict(lambda: None, {starting_vertex: 0})
 		self.parents = defaultdict(lambda: None, {starting_vertex: None})
 		level = 1
@@ -49,43 +605,314 @@ class Graph:
 			frontier = next_frontier
 			level += 1
 
-	def shortest_path(self, starting_vertex, ending_vertex):
+	def multi_source_breadth_first_search(self, sources, direction_optimizing=False, max_depth=None):
+		"""
+		BFS distances from every vertex of 'sources', 64 of them at a time: the
+		sources that reached a vertex are the bits of one uint64, so every
+		level of all 64 searches is a few NumPy operations over the edges.
+
+		direction_optimizing - expand the frontier top-down (along the edges
+		leaving it) while it is small, and bottom-up (every unfinished vertex
+		looks at the edges into it) while it is large, as in Beamer et al.
+		Helps most on graphs of low diameter.
+		max_depth - stop after this many levels, e.g. for k-hop neighborhoods
+
+		Returns a VertexPairMatrix with a row for each source; unreachable
+		verticies are at distance math.inf.
+		"""
+		sources = list(sources)
+		for vertex in sources:
+			assert vertex in self.verticies, "Invalid starting vertex %s" % (vertex)
+
+		csr = self.csr if self.storage == 'csr' else CSRAdjacency(self.verticies, self.edges)
+		n = len(csr)
+		distances = np.full((len(sources), n), math.inf)
+		if len(sources) < self.bit_parallel_min_sources:
+			for row, vertex in enumerate(sources):
+				self._breadth_first_distances(csr, csr.vertex_to_id[vertex], distances[row], max_depth)
+			return VertexPairMatrix(csr.verticies, distances, sources=sources)
+
+		out_offsets = np.asarray(csr.offsets, dtype=np.int64)
+		out_neighbors = np.asarray(csr.neighbors, dtype=np.int64)
+		in_offsets = in_sources = None
+		if direction_optimizing:
+			# Edges into every vertex, for the bottom-up steps
+			edge_sources = np.repeat(np.arange(n), np.diff(out_offsets))
+			in_sources = edge_sources[np.argsort(out_neighbors, kind='stable')]
+			in_offsets = np.zeros(n + 1, dtype=np.int64)
+			np.cumsum(np.bincount(out_neighbors, minlength=n), out=in_offsets[1:])
+
+		for start in range(0, len(sources), 64):
+			block = [csr.vertex_to_id[vertex] for vertex in sources[start:start + 64]]
+			self._bit_parallel_breadth_first_search(block, distances[start:start + 64],
+				out_offsets, out_neighbors, in_offsets, in_sources, direction_optimizing, max_depth)
+
+		return VertexPairMatrix(csr.verticies, distances, sources=sources)
+
+	@staticmethod
+	def _edge_ranges(offsets, verticies):
+		"""Indices of the edges of 'verticies' in CSR arrays, and their counts"""
+		counts = offsets[verticies + 1] - offsets[verticies]
+		starts = np.repeat(offsets[verticies] - np.cumsum(counts) + counts, counts)
+		return starts + np.arange(counts.sum()), counts
+
+	@staticmethod
+	def _breadth_first_distances(csr, source, distances, max_depth):
+		"""Plain BFS from the id source, filling the row distances"""
+		offsets, neighbors = csr.offsets, csr.neighbors
+		reached = bytearray(len(csr))
+		reached[source] = 1
+		# Verticies in order of distance, and where each level starts
+		order = [source]
+		starts = [0, 1]
+		while len(order) > starts[-2] and (max_depth is None or len(starts) - 1 <= max_depth):
+			for u in order[starts[-2]:starts[-1]]:
+				for v in neighbors[offsets[u]:offsets[u + 1]]:
+					if not reached[v]:
+						reached[v] = 1
+						order.append(v)
+			starts.append(len(order))
+		distances[order] = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+
+	def _bit_parallel_breadth_first_search(self, block, distances, out_offsets, out_neighbors,
+		in_offsets, in_sources, direction_optimizing, max_depth):
+		"""
+		BFS from the ids in block (at most 64), filling their rows of distances.
+		The frontier is kept as an array of ids with their bits, so a top-down
+		level only touches the edges leaving the frontier and the verticies
+		they reach.
+		"""
+		# Beamer's thresholds for switching directions
+		alpha, beta = 14, 24
+
+		n = len(out_offsets) - 1
+		k = len(block)
+		everything = np.uint64((1 << k) - 1)
+		seen = np.zeros(n, dtype=np.uint64)
+		for bit, source in enumerate(block):
+			seen[source] |= np.uint64(1 << bit)
+			distances[bit, source] = 0
+		active = np.unique(np.array(block, dtype=np.int64))
+		frontier = seen[active]
+
+		if direction_optimizing:
+			# Dense copy of the frontier bits, only filled for bottom-up steps
+			dense_frontier = np.zeros(n, dtype=np.uint64)
+			# Edges into the verticies not yet reached by every source
+			unexplored_edges = in_offsets[n]
+			finished = active[frontier == everything]
+			unexplored_edges -= (in_offsets[finished + 1] - in_offsets[finished]).sum()
+
+		# Verticies reached at each level with their new bits, turned into
+		# distances at the end
+		levels, reached_ids, reached_bits = [np.zeros(0, dtype=np.int64)], [active[:0]], [frontier[:0]]
+		bottom_up = False
+		level = 1
+		while len(active) and (max_depth is None or level <= max_depth):
+			if direction_optimizing:
+				frontier_edges = (out_offsets[active + 1] - out_offsets[active]).sum()
+				if not bottom_up and frontier_edges > unexplored_edges / alpha:
+					bottom_up = True
+				elif bottom_up and len(active) < n / beta:
+					bottom_up = False
+
+			if bottom_up:
+				# Every unfinished vertex ORs the frontier bits of its in-neighbors
+				dense_frontier[active] = frontier
+				unfinished = np.flatnonzero(seen != everything)
+				edges, counts = self._edge_ranges(in_offsets, unfinished)
+				reached = unfinished[counts > 0]
+				bits = np.zeros(0, dtype=np.uint64)
+				if len(reached):
+					starts = np.cumsum(counts[counts > 0]) - counts[counts > 0]
+					bits = np.bitwise_or.reduceat(dense_frontier[in_sources[edges]], starts)
+				dense_frontier[active] = 0
+				bits &= ~seen[reached]
+			else:
+				# OR the frontier bits along the edges leaving the frontier
+				edges, counts = self._edge_ranges(out_offsets, active)
+				targets = out_neighbors[edges]
+				bits = np.repeat(frontier, counts) & ~seen[targets]
+				order = np.argsort(targets, kind='stable')
+				targets, bits = targets[order], bits[order]
+				first = np.ones(len(targets), dtype=bool)
+				first[1:] = targets[1:] != targets[:-1]
+				reached = targets[first]
+				bits = np.bitwise_or.reduceat(bits, np.flatnonzero(first)) if len(reached) else bits
+
+			new = bits != 0
+			active, frontier = reached[new], bits[new]
+			seen[active] |= frontier
+			if direction_optimizing:
+				finished = active[seen[active] == everything]
+				unexplored_edges -= (in_offsets[finished + 1] - in_offsets[finished]).sum()
+
+			levels.append(np.full(len(active), level))
+			reached_ids.append(active)
+			reached_bits.append(frontier)
+			level += 1
+
+		# Bit i of a vertex's bits at a level is source i reaching it then
+		levels, reached_ids = np.concatenate(levels), np.concatenate(reached_ids)
+		bits = np.concatenate(reached_bits).astype('<u8').view(np.uint8)
+		rows, columns = np.nonzero(np.unpackbits(bits, bitorder='little').reshape(-1, 64)[:, :k])
+		distances[columns, reached_ids[rows]] = levels[rows]
+
+	def _csr_breadth_first_search(self, starting_vertex):
+		csr = self.csr
+		offsets, neighbors = csr.offsets, csr.neighbors
+		source = csr.vertex_to_id[starting_vertex]
+
+		distances = [ABSENT] * len(csr)
+		parents = [ABSENT] * len(csr)
+		distances[source] = 0
+		parents[source] = None
+		level = 1
+		frontier = [source]
+		while frontier:
+			next_frontier = []
+			for u in frontier:
+				for v in neighbors[offsets[u]:offsets[u + 1]]:
+					if distances[v] is ABSENT:
+						distances[v] = level
+						parents[v] = u
+						next_frontier.append(v)
+			frontier = next_frontier
+			level += 1
+
+		self.distance_from_start = VertexMap(csr, distances)
+		self.parents = VertexMap(csr, parents, ids=True)
+
+	def iter_settled(self, starting_vertex):
+		"""
+		Breadth first search as a generator of (vertex, distance) pairs in
+		order of distance. Stop iterating to end the search early; self.parents
+		holds the search tree of the verticies yielded so far.
+		"""
+		if self.storage == 'csr':
+			yield from self._csr_iter_settled(starting_vertex)
+			return
+
+		self.parents = defaultdict(lambda: None, {starting_vertex: None})
+		yield starting_vertex, 0
+		level = 1
+		frontier = [starting_vertex]
+		while frontier:
+			next_frontier = []
+			for frontier_vertex in frontier:
+				for adjacent_vertex in self.adjacency_map[frontier_vertex]:
+					if adjacent_vertex not in self.parents:
+						self.parents[adjacent_vertex] = frontier_vertex
+						yield adjacent_vertex, level
+						next_frontier.append(adjacent_vertex)
+			frontier = next_frontier
+			level += 1
+
+	def _csr_iter_settled(self, starting_vertex):
+		csr = self.csr
+		offsets, neighbors, verticies = csr.offsets, csr.neighbors, csr.verticies
+		source = csr.vertex_to_id[starting_vertex]
+
+		parents = [ABSENT] * len(csr)
+		parents[source] = None
+		self.parents = VertexMap(csr, parents, ids=True)
+		yield starting_vertex, 0
+		level = 1
+		frontier = [source]
+		while frontier:
+			next_frontier = []
+			for u in frontier:
+				for v in neighbors[offsets[u]:offsets[u + 1]]:
+					if parents[v] is ABSENT:
+						parents[v] = u
+						yield verticies[v], level
+						next_frontier.append(v)
+			frontier = next_frontier
+			level += 1
+
+	def shortest_path(self, starting_vertex, ending_vertex, early_exit=False, return_path=False):
+		"""
+		early_exit - search from starting_vertex only until ending_vertex is
+		reached, instead of computing (and keeping) every distance
+		return_path - return (distance, path), path being the list of
+		verticies from starting_vertex to ending_vertex, or None if there is
+		no path. Implies early_exit.
+		"""
 		assert starting_vertex in self.verticies, \
 		"Invalid starting vertex %s" % (starting_vertex)
 		assert ending_vertex in self.verticies, \
 		"Invalid ending vertex %s" % (ending_vertex)
 
+		if early_exit or return_path:
+			distance = self._search_to(starting_vertex, ending_vertex)
+			if not return_path:
+				return distance
+			return distance, self._path_from_parents(starting_vertex, ending_vertex, distance)
+
 		# if self.distance_from_start not yet computed, compute it
 		if not self.distance_from_start or self.distance_from_start[starting_vertex] != 0:
 				self.breadth_first_search(starting_vertex)
 
 		return self.distance_from_start[ending_vertex]
 
-	def _depth_first_visit(self, starting_vertex):
+	def _search_to(self, starting_vertex, ending_vertex):
+		"""Distance to ending_vertex, searching no further than needed"""
+		for vertex, distance in self.iter_settled(starting_vertex):
+			if vertex == ending_vertex:
+				return distance
+		return None
+
+	def _path_from_parents(self, starting_vertex, ending_vertex, distance):
+		if distance is None or distance == math.inf:
+			return None
+
+		path = [ending_vertex]
+		while path[-1] != starting_vertex:
+			path.append(self.parents[path[-1]])
+		path.reverse()
+		return path
+
+	def _depth_first_visit(self, starting_vertex, back_edges=True):
+		# Explicit stack of (vertex, iterator over its remaining neighbors),
+		# so long paths don't hit the recursion limit
 		self.time += 1
 		self.discover_times[starting_vertex] = self.time
-		for adjacent_vertex in self.adjacency_map[starting_vertex]:
-			# Check for back edges
-			# (u,v) is a back edge when discovered but not finished
-			if (adjacent_vertex in self.discover_times 
-				and adjacent_vertex not in self.finishing_times):
-				# (u,v) and (v,u) doesn't not count as a cycle in an udirected graph
-				if ((not self.is_directed 
-					and self.parents[starting_vertex] != adjacent_vertex)
-					or self.is_directed):
-					self.back_edges.add((starting_vertex, adjacent_vertex))
-
-			if adjacent_vertex not in self.parents:
-				self.parents[adjacent_vertex] = starting_vertex
-				self._depth_first_visit(adjacent_vertex)
-		self.time += 1
-		self.finishing_times[starting_vertex] = self.time
+		stack = [(starting_vertex, iter(self.adjacency_map[starting_vertex]))]
+		while stack:
+			vertex, adjacent = stack[-1]
+			for adjacent_vertex in adjacent:
+				if adjacent_vertex not in self.parents:
+					self.parents[adjacent_vertex] = vertex
+					self.time += 1
+					self.discover_times[adjacent_vertex] = self.time
+					stack.append((adjacent_vertex, iter(self.adjacency_map[adjacent_vertex])))
+					break
+
+				# (u,v) is a back edge when v is discovered but not finished
+				if (adjacent_vertex not in self.finishing_times
+					and (back_edges or not self.back_edges)
+					# (u,v) and (v,u) doesn't not count as a cycle in an udirected graph
+					and (self.is_directed or self.parents[vertex] != adjacent_vertex)):
+					self.back_edges.add((vertex, adjacent_vertex))
+			else:
+				stack.pop()
+				self.time += 1
+				self.finishing_times[vertex] = self.time
+
+	def depth_first_search(self, back_edges=True):
+		"""
+		back_edges - collect every back edge in self.back_edges. If False, only
+		the first one found is kept, which is all that deciding acyclicity needs.
+		"""
+		self.back_edges = set()
+
+		if self.storage == 'csr':
+			self._csr_depth_first_search(back_edges)
+			return
 
-	def depth_first_search(self):
 		self.parents = defaultdict(lambda: None)
 		self.discover_times = {}
 		self.finishing_times = {}
-		self.back_edges = set()
 
 		self.time = 0
 
@@ -93,13 +920,64 @@ class Graph:
 			# if vertex not yet visited
 			if vertex not in self.parents:
 				self.parents[vertex] = None
-				self._depth_first_visit(vertex)
+				self._depth_first_visit(vertex, back_edges)
+
+	def _csr_depth_first_search(self, back_edges=True):
+		csr = self.csr
+		offsets, neighbors, verticies = csr.offsets, csr.neighbors, csr.verticies
+		n = len(csr)
+
+		parents = [ABSENT] * n
+		discover_times = [ABSENT] * n
+		finishing_times = [ABSENT] * n
+		# Next edge to look at for every vertex on the stack
+		next_edge = array('q', offsets[:-1])
+		time = 0
+
+		for root in range(n):
+			if parents[root] is not ABSENT:
+				continue
+			parents[root] = None
+			time += 1
+			discover_times[root] = time
+			stack = [root]
+			while stack:
+				u = stack[-1]
+				k = next_edge[u]
+				if k == offsets[u + 1]:
+					stack.pop()
+					time += 1
+					finishing_times[u] = time
+					continue
+				next_edge[u] = k + 1
+
+				v = neighbors[k]
+				if parents[v] is ABSENT:
+					parents[v] = u
+					time += 1
+					discover_times[v] = time
+					stack.append(v)
+				elif (finishing_times[v] is ABSENT
+					and (back_edges or not self.back_edges)
+					and (self.is_directed or parents[u] != v)):
+					self.back_edges.add((verticies[u], verticies[v]))
+
+		self.time = time
+		self.parents = VertexMap(csr, parents, ids=True)
+		self.discover_times = VertexMap(csr, discover_times)
+		self.finishing_times = VertexMap(csr, finishing_times)
 
 	def topological_sort(self):
 		# Only works for DAGs
 		assert self.is_acyclic, "Must be an acyclic graph to topologically sort"
 		assert self.is_directed, "Must be a directed graph to topologically sort"
 
+		# Order maintained by add_edges, no DFS needed
+		if self._topological_order is not None:
+			order = self._topological_order
+			self.sorted_verticies = sorted(order, key=order.get)
+			return
+
 		# If DFS has not been run yet
 		if not self.discover_times:
 			self.depth_first_search()
@@ -112,26 +990,393 @@ class Graph:
 		for vertex, time in f_times:
 			self.sorted_verticies.append(vertex)
 
+	def strongly_connected_components(self):
+		"""
+		Iterative Tarjan's algorithm over vertex ids. Returns the components
+		as lists of verticies in topological order: every edge between two
+		components goes from an earlier one to a later one. self.component_of
+		maps every vertex to the index of its component.
+		"""
+		csr = self.csr if self.storage == 'csr' else CSRAdjacency(self.verticies, self.edges)
+		component_ids, count = self._strongly_connected_ids(csr)
+
+		components = [[] for i in range(count)]
+		for u, c in enumerate(component_ids):
+			components[c].append(csr.verticies[u])
+		if self.storage == 'csr':
+			self.component_of = VertexMap(csr, list(component_ids))
+		else:
+			self.component_of = dict(zip(csr.verticies, component_ids))
+
+		return components
+
+	@staticmethod
+	def _strongly_connected_ids(csr):
+		"""Component of every vertex id (an array, topologically numbered) and
+		the number of components"""
+		offsets, neighbors = csr.offsets, csr.neighbors
+		n = len(csr)
+
+		index = array('q', [-1]) * n
+		lowlink = array('q', [0]) * n
+		on_stack = bytearray(n)
+		component_ids = array('q', [-1]) * n
+		# Next edge of every vertex on the call stack
+		next_edge = array('q', offsets[:-1])
+		stack = []
+		counter = 0
+		count = 0
+
+		for root in range(n):
+			if index[root] != -1:
+				continue
+			index[root] = lowlink[root] = counter
+			counter += 1
+			stack.append(root)
+			on_stack[root] = 1
+			call_stack = [root]
+			while call_stack:
+				u = call_stack[-1]
+				k = next_edge[u]
+				if k < offsets[u + 1]:
+					next_edge[u] = k + 1
+					v = neighbors[k]
+					if index[v] == -1:
+						index[v] = lowlink[v] = counter
+						counter += 1
+						stack.append(v)
+						on_stack[v] = 1
+						call_stack.append(v)
+					elif on_stack[v] and index[v] < lowlink[u]:
+						lowlink[u] = index[v]
+					continue
+
+				call_stack.pop()
+				if call_stack and lowlink[u] < lowlink[call_stack[-1]]:
+					lowlink[call_stack[-1]] = lowlink[u]
+				# u is the root of a component: everything above it on the stack
+				if lowlink[u] == index[u]:
+					while True:
+						v = stack.pop()
+						on_stack[v] = 0
+						component_ids[v] = count
+						if v == u:
+							break
+					count += 1
+
+		# Tarjan's algorithm finds the components in reverse topological order
+		for u in range(n):
+			component_ids[u] = count - 1 - component_ids[u]
+
+		return component_ids, count
+
+	def condensation(self):
+		"""
+		DAG of the strongly connected components: vertex i is component i of
+		strongly_connected_components() (so range(k) is a topological order)
+		and there is an edge (i, j) if an edge goes from component i to j. For
+		a WeightedGraph, its weight is the lightest of those edges. The result
+		is a Graph/WeightedGraph with the same storage, so topological_sort and
+		the DAG shortest paths work on it.
+		"""
+		self.strongly_connected_components()
+		if self.storage == 'csr':
+			csr = self.csr
+			component_ids = np.array(self.component_of.values_by_id, dtype=np.int64)
+		else:
+			csr = CSRAdjacency(self.verticies, self.edges, weighted=self.weighted)
+			component_ids = np.array([self.component_of[vertex] for vertex in csr.verticies], dtype=np.int64)
+		count = int(component_ids.max()) + 1 if len(component_ids) else 0
+
+		sources = component_ids[np.frombuffer(csr.edge_sources(), dtype=np.int64)]
+		targets = component_ids[np.frombuffer(csr.neighbors, dtype=np.int64)]
+		between = sources != targets
+		keys = sources[between] * count + targets[between]
+
+		if not csr.weighted:
+			keys = np.unique(keys)
+			edges = list(zip((keys // count).tolist(), (keys % count).tolist()))
+			return Graph(range(count), edges, is_directed=True, storage=self.storage)
+
+		weights = np.asarray(csr.weights)[between]
+		order = np.lexsort((weights, keys))
+		keys, weights = keys[order], weights[order]
+		# The lightest edge comes first among those with the same key
+		first = np.flatnonzero(np.diff(keys, prepend=-1))
+		keys = keys[first]
+		edges = list(zip((keys // count).tolist(), (keys % count).tolist(), weights[first].tolist()))
+		return WeightedGraph(range(count), edges, is_directed=True, storage=self.storage)
+
 	def extend(self, verticies=(), edges=()):
 		if not verticies and not edges:
 			return
 
+		self.add_vertices(verticies)
+		self.add_edges(edges)
+
+	def add_vertices(self, verticies):
+		"""
+		Adds verticies to the graph without rebuilding it. The new verticies
+		are isolated, so they don't affect acyclicity or any distances.
+		"""
+		new_verticies = [vertex for vertex in set(verticies) if vertex not in self.verticies]
+		if not new_verticies:
+			return
+
+		self.verticies.update(new_verticies)
+
+		# Arrays can't be patched in place
+		if self.storage == 'csr':
+			self._setup_adjacency_map()
+
+		# An isolated vertex can go anywhere in a topological order
+		if self._topological_order is not None:
+			for vertex in new_verticies:
+				self._topological_order[vertex] = len(self._topological_order)
+		if self.sorted_verticies is not None:
+			self.sorted_verticies.extend(new_verticies)
+		if self._components is not None:
+			for vertex in new_verticies:
+				self._components.new_set(vertex)
+
+		self._verticies_added(new_verticies)
+
+	def add_edges(self, edges):
+		"""
+		Adds edges (same formats as the constructor) by patching the adjacency
+		map in place instead of rebuilding the graph. An edge that already
+		exists with a different weight is replaced. Acyclicity is maintained
+		incrementally, and only the stored results that the new edges can
+		change are invalidated.
+		"""
 		edges = self._convert_set_to_tuples(edges)
+		# Later duplicates in the same batch win
+		batch = {(edge[0], edge[1]): edge for edge in edges}
+		if not batch:
+			return
 
-		new_verticies = set(verticies)
-		new_edges = set(edges)
+		self._prepare_incremental()
+		# Graphs built from CSR arrays only have a view of their edges
+		if not isinstance(self.edges, set):
+			self.edges = set(self.edges)
+
+		changed = False
+		# Edges between verticies that weren't adjacent before
+		added = []
+		for (vertex1, vertex2), edge in batch.items():
+			assert vertex1 in self.verticies, "Undefined edge: %s" % (edge,)
+			assert vertex2 in self.verticies, "Undefined edge: %s" % (edge,)
+
+			old_weight = self._edge_weight(vertex1, vertex2)
+			weight = self._weight_of(edge)
+			if old_weight is not None:
+				if old_weight == weight:
+					continue
+				self._delete_edge(vertex1, vertex2, old_weight)
+				self._edge_removed(vertex1, vertex2, old_weight)
+			else:
+				added.append((vertex1, vertex2))
+
+			self._insert_edge(edge)
+			self._edge_added(vertex1, vertex2, weight)
+			changed = True
+
+		if self.storage == 'csr' and changed:
+			self._setup_adjacency_map()
+
+		if self.is_acyclic:
+			# The edges are already in the adjacency map, so the order is updated
+			# one edge at a time, ignoring the edges not processed yet
+			pending = set(added)
+			checked = set()
+			for vertex1, vertex2 in added:
+				pending.discard((vertex1, vertex2))
+				# Both halves of an undirected edge are added, only check it once
+				if not self.is_directed:
+					if (vertex2, vertex1) in checked:
+						continue
+					checked.add((vertex1, vertex2))
+
+				if not self._acyclic_after_adding(vertex1, vertex2, pending):
+					self.is_acyclic = False
+					self._topological_order = None
+					self._predecessors = None
+					self._components = None
+					self.sorted_verticies = None
+					break
+
+	def remove_edges(self, edges):
+		"""
+		Removes edges (same formats as the constructor; weights are ignored)
+		by patching the adjacency map in place. Removing edges can't create a
+		cycle, so acyclicity only has to be recomputed for a cyclic graph.
+		"""
+		edges = self._convert_set_to_tuples(edges)
+		if not isinstance(self.edges, set):
+			self.edges = set(self.edges)
+
+		removed = False
+		for edge in set((edge[0], edge[1]) for edge in edges):
+			vertex1, vertex2 = edge
+			weight = self._edge_weight(vertex1, vertex2)
+			if weight is None:
+				continue
+
+			self._delete_edge(vertex1, vertex2, weight)
+			if self._predecessors is not None:
+				self._predecessors[vertex2].discard(vertex1)
+			self._edge_removed(vertex1, vertex2, weight)
+			removed = True
+
+		if not removed:
+			return
 
-		self.verticies = self.verticies | new_verticies
-		self.edges = self.edges | new_edges
+		if self.storage == 'csr':
+			self._setup_adjacency_map()
 
-		self._setup_adjacency_map()
+		# The components of a forest split, the DisjointSet can't follow
+		self._components = None
 
-		self._reset_attributes()
+		if not self.is_acyclic:
+			self.is_acyclic = self._is_acyclic()
 
-		self.is_acyclic = self._is_acyclic()
+	def _prepare_incremental(self):
+		"""Builds the structures that add_edges uses to maintain acyclicity,
+		from the graph as it is before the edges are added."""
+		if not self.is_acyclic:
+			return
+
+		if self.is_directed and self._topological_order is None:
+			if self.sorted_verticies is None:
+				self.topological_sort()
+			self._topological_order = {vertex: i for i, vertex in enumerate(self.sorted_verticies)}
+			self._predecessors = defaultdict(set)
+			for edge in self.edges:
+				self._predecessors[edge[1]].add(edge[0])
+
+		elif not self.is_directed and self._components is None:
+			self._components = DisjointSet()
+			for vertex in self.verticies:
+				self._components.new_set(vertex)
+			for edge in self.edges:
+				root1 = self._components.find(edge[0])
+				root2 = self._components.find(edge[1])
+				if root1 != root2:
+					self._components.union(root1, root2)
+
+	def _acyclic_after_adding(self, vertex1, vertex2, pending):
+		if vertex1 == vertex2:
+			return False
+
+		if not self.is_directed:
+			root1 = self._components.find(vertex1)
+			root2 = self._components.find(vertex2)
+			if root1 == root2:
+				return False
+			self._components.union(root1, root2)
+			return True
+
+		self._predecessors[vertex2].add(vertex1)
+		return self._update_topological_order(vertex1, vertex2, pending)
+
+	def _update_topological_order(self, vertex1, vertex2, pending=()):
+		"""
+		Pearce-Kelly online topological ordering for the new edge (vertex1,
+		vertex2). Only the verticies ordered between the two endpoints are
+		searched and reordered. Edges in 'pending' are not part of the graph
+		yet. Returns False if the edge closes a cycle.
+		"""
+		order = self._topological_order
+		lower, upper = order[vertex2], order[vertex1]
+		if upper < lower:
+			return True
+
+		# Verticies reachable from vertex2 that are ordered before vertex1
+		forward = [vertex2]
+		seen = {vertex2}
+		stack = [vertex2]
+		while stack:
+			vertex = stack.pop()
+			for adjacent_vertex in self.adjacency_map[vertex]:
+				if (vertex, adjacent_vertex) in pending:
+					continue
+				if adjacent_vertex == vertex1:
+					return False
+				if adjacent_vertex not in seen and order[adjacent_vertex] < upper:
+					seen.add(adjacent_vertex)
+					forward.append(adjacent_vertex)
+					stack.append(adjacent_vertex)
+
+		# Verticies that reach vertex1 that are ordered after vertex2
+		backward = [vertex1]
+		seen = {vertex1}
+		stack = [vertex1]
+		while stack:
+			vertex = stack.pop()
+			for adjacent_vertex in self._predecessors[vertex]:
+				if adjacent_vertex not in seen and order[adjacent_vertex] > lower:
+					seen.add(adjacent_vertex)
+					backward.append(adjacent_vertex)
+					stack.append(adjacent_vertex)
+
+		# Reuse the positions of both groups, putting all of backward first
+		backward.sort(key=order.get)
+		forward.sort(key=order.get)
+		moved = backward + forward
+		positions = sorted(order[vertex] for vertex in moved)
+		for vertex, position in zip(moved, positions):
+			order[vertex] = position
+
+		self.sorted_verticies = None
+		return True
+
+	def _edge_weight(self, vertex1, vertex2):
+		"""Weight of the edge (vertex1, vertex2), or None if there is none"""
+		return 1 if (vertex1, vertex2) in self.edges else None
+
+	def _weight_of(self, edge):
+		return 1
+
+	def _insert_edge(self, edge):
+		self.edges.add(edge)
+		if self.storage == 'map':
+			self.adjacency_map[edge[0]].add(edge[1])
+
+	def _delete_edge(self, vertex1, vertex2, weight):
+		self.edges.remove((vertex1, vertex2))
+		if self.storage == 'map':
+			self.adjacency_map[vertex1].discard(vertex2)
+
+	def _verticies_added(self, verticies):
+		"""Invalidates results that the new verticies make stale"""
+		# DFS covers every vertex
+		self.discover_times = None
+
+	def _edge_added(self, vertex1, vertex2, weight):
+		"""Invalidates results that the new edge can change"""
+		self.discover_times = None
+
+		# BFS distances only change if vertex1 was reached and the edge is a
+		# shortcut to vertex2
+		if self.distance_from_start:
+			distance1 = self.distance_from_start[vertex1]
+			distance2 = self.distance_from_start[vertex2]
+			if distance1 is not None and (distance2 is None or distance1 + 1 < distance2):
+				self.distance_from_start = None
+
+	def _edge_removed(self, vertex1, vertex2, weight):
+		"""Invalidates results that depended on the removed edge"""
+		self.discover_times = None
+
+		# Only an edge on some shortest path to vertex2 can matter
+		if self.distance_from_start:
+			distance1 = self.distance_from_start[vertex1]
+			distance2 = self.distance_from_start[vertex2]
+			if distance1 is not None and distance1 + 1 == distance2:
+				self.distance_from_start = None
 
 	def _is_acyclic(self):
-		self.depth_first_search()
+		self.depth_first_search(back_edges=False)
 
 		if self.back_edges:
 			return False
@@ -175,6 +1420,12 @@ class Graph:
 		return edges
 
 	def _setup_adjacency_map(self):
+		if self.storage == 'csr':
+			self._use_csr(CSRAdjacency(self.verticies, self.edges))
+			# The arrays hold the edges; mutations turn this back into a set
+			self.edges = CSREdges(self.csr)
+			return
+
 		self.adjacency_map = defaultdict(set)
 
 		# create adjacency_map, the main representation of the graph
@@ -186,6 +1437,10 @@ class Graph:
 			# adjacency map maps every vertex to a set of adjacent verticies
 			self.adjacency_map[edge[0]].add(edge[1])
 
+	def _use_csr(self, csr):
+		self.csr = csr
+		self.adjacency_map = csr
+
 	def __repr__(self):
 		return "V: " + str(self.verticies) + " E: " + str(self.edges)
 
@@ -197,12 +1452,32 @@ class WeightedGraph(Graph):
 	Edges format for each element: (u,v,weight) or ({u,v},weight). 
 	Second format gets converted to (u,v,weight) and (v,u,weight)
 	"""
-	def __init__(self, verticies=(), edges=(), is_directed=False):
-		super().__init__(verticies, edges, is_directed)
-
-		self._setup_adjacency_matrix()
+	weighted = True
+
+	# Priority queue of Dijkstra's algorithm: 'heap', 'dial' (bucket queue),
+	# 'radix' (radix heap) or None to pick one. The last two need integer
+	# weights; Dial's algorithm is picked if no weight exceeds dial_max_weight,
+	# else the radix heap, which only beats heapq on ids for the map storage.
+	dijkstra_queue = None
+	dial_max_weight = 1000
+	# Bellman-Ford only relaxes the edges out of verticies whose distance
+	# changed (SPFA) if True, else it makes passes over every edge
+	bellman_ford_queue = True
+
+	# shortest_path keeps the distances and parents of recently used sources,
+	# evicting the least recently used. Every source costs O(V) memory, so
+	# this bounds the total number of distances held rather than the number
+	# of sources.
+	shortest_paths_cache_size = 2 ** 20
+
+	def __init__(self, verticies=(), edges=(), is_directed=False, storage='map'):
+		super().__init__(verticies, edges, is_directed, storage)
+
+		# Only Floyd-Warshall needs the V x V matrix, so it is built on first use
+		self.adjacency_matrix = None
 
 	def _convert_set_to_tuples(self, edges):
+		sets = False
 		for edge in edges:
 			if isinstance(edge[0], set):
 				sets = True
@@ -228,123 +1503,516 @@ class WeightedGraph(Graph):
 
 
 	def _setup_adjacency_map(self):
+		# Edges into every vertex, built on first use by _reverse_adjacency_map
+		self._reverse_adjacency = None
+
+		if self.storage == 'csr':
+			self._use_csr(CSRAdjacency(self.verticies, self.edges, weighted=True))
+			self.edges = CSREdges(self.csr)
+			return
+
 		self.adjacency_map = defaultdict(dict)
 
-		self.negative_edges = False
+		self._negative_weights = 0
 
 		for vertex1, vertex2, weight in self.edges:
 			assert vertex1 in self.verticies, "Undefined vertex: %s" % (vertex1)
 			assert vertex2 in self.verticies, "Undefined vertex: %s" % (vertex2)
 
 			if weight < 0:
-				self.negative_edges = True
+				self._negative_weights += 1
 
 			self.adjacency_map[vertex1][vertex2] = weight
 
+		self.negative_edges = self._negative_weights > 0
+		self._find_max_integer_weight()
+
+	def _use_csr(self, csr):
+		super()._use_csr(csr)
+		self._reverse_adjacency = None
+		self.adjacency_matrix = None
+
+		weights = np.asarray(csr.weights)
+		self._negative_weights = int(np.count_nonzero(weights < 0))
+		self.negative_edges = self._negative_weights > 0
+		if weights.dtype.kind != 'i':
+			self._non_integer_weights = len(weights)
+			self._max_integer_weight = None
+		else:
+			self._non_integer_weights = self._negative_weights
+			self._max_integer_weight = int(weights.max()) if len(weights) else 0
+			self._max_weight_count = int(np.count_nonzero(weights == self._max_integer_weight))
+
+	@property
+	def max_integer_weight(self):
+		"""Largest weight if every weight is a non-negative int, else None"""
+		if self._non_integer_weights:
+			return None
+		# Stale since the last edge of the largest weight was removed
+		if self._max_integer_weight is None:
+			self._find_max_integer_weight()
+		return self._max_integer_weight
+
+	def _find_max_integer_weight(self):
+		"""
+		Counts the weights that are not non-negative ints, and finds the
+		largest weight and the number of edges that have it. Edge insertions
+		and deletions keep these up to date, except that deleting the last
+		edge of the largest weight leaves _max_integer_weight as None until
+		max_integer_weight is next read.
+		"""
+		self._non_integer_weights = 0
+		self._max_integer_weight = 0
+		self._max_weight_count = 0
+		for edge in self.edges:
+			weight = edge[2]
+			if not isinstance(weight, int) or weight < 0:
+				self._non_integer_weights += 1
+			elif weight > self._max_integer_weight:
+				self._max_integer_weight = weight
+				self._max_weight_count = 1
+			elif weight == self._max_integer_weight:
+				self._max_weight_count += 1
+
 	def _setup_adjacency_matrix(self):
+		"""Dense float64 matrix of edge weights, indexed like ordered_verticies.
+		Filled from the edges in O(V^2 + E) instead of testing every pair."""
 		self.ordered_verticies = sorted(list(self.verticies))
+		vertex_index = {vertex: i for i, vertex in enumerate(self.ordered_verticies)}
 
-		self.adjacency_matrix = {}
-		for i in range(len(self.verticies)):
-			for j in range(len(self.verticies)):
-				if i == j:
-					self.adjacency_matrix[i,j] = 0
-				else:
-					self.adjacency_matrix[i,j] = math.inf
+		n = len(self.verticies)
+		self.adjacency_matrix = np.full((n, n), math.inf)
+		np.fill_diagonal(self.adjacency_matrix, 0)
+
+		if self.storage == 'csr':
+			csr = self.csr
+			index = np.array([vertex_index[vertex] for vertex in csr.verticies], dtype=np.int64)
+			sources = index[np.frombuffer(csr.edge_sources(), dtype=np.int64)]
+			targets = index[np.frombuffer(csr.neighbors, dtype=np.int64)]
+			self.adjacency_matrix[sources, targets] = csr.weights
+			return
 
-		for i, vertex1 in enumerate(self.ordered_verticies):
-			for j, vertex2 in enumerate(self.ordered_verticies):
-				if vertex2 in self.adjacency_map[vertex1]:
-					weight = self.adjacency_map[vertex1][vertex2]
-					self.adjacency_matrix[i,j] = weight
+		for vertex1, adjacent in self.adjacency_map.items():
+			i = vertex_index[vertex1]
+			for vertex2, weight in adjacent.items():
+				self.adjacency_matrix[i, vertex_index[vertex2]] = weight
 
 	def _reset_attributes(self):
 		super()._reset_attributes()
 		self.shortest_paths = None
 		self.shortest_paths_all = None
+		# Source -> (distances, parents), most recently used last
+		self._shortest_paths_cache = OrderedDict()
+		self.cache_hits = 0
+		self.cache_misses = 0
 
-	def extend(self, verticies=(), edges=()):
-		super().extend(verticies, edges)
-		self._setup_adjacency_matrix()
+	def _edge_weight(self, vertex1, vertex2):
+		return self.adjacency_map[vertex1].get(vertex2)
+
+	def _weight_of(self, edge):
+		return edge[2]
+
+	def _insert_edge(self, edge):
+		vertex1, vertex2, weight = edge
+		self.edges.add(edge)
+		if self.storage == 'map':
+			self.adjacency_map[vertex1][vertex2] = weight
+		if weight < 0:
+			self._negative_weights += 1
+			self.negative_edges = True
+		if not isinstance(weight, int) or weight < 0:
+			self._non_integer_weights += 1
+		elif self._max_integer_weight is not None:
+			if weight > self._max_integer_weight:
+				self._max_integer_weight = weight
+				self._max_weight_count = 1
+			elif weight == self._max_integer_weight:
+				self._max_weight_count += 1
+
+	def _delete_edge(self, vertex1, vertex2, weight):
+		self.edges.remove((vertex1, vertex2, weight))
+		if self.storage == 'map':
+			del self.adjacency_map[vertex1][vertex2]
+		if weight < 0:
+			self._negative_weights -= 1
+			self.negative_edges = self._negative_weights > 0
+		if not isinstance(weight, int) or weight < 0:
+			self._non_integer_weights -= 1
+		elif weight == self._max_integer_weight:
+			self._max_weight_count -= 1
+			if not self._max_weight_count:
+				self._max_integer_weight = None
+
+	def _verticies_added(self, verticies):
+		super()._verticies_added(verticies)
+		self.shortest_paths_all = None
+		self.adjacency_matrix = None
+
+	def _edge_added(self, vertex1, vertex2, weight):
+		super()._edge_added(vertex1, vertex2, weight)
+		self.shortest_paths_all = None
+		self.adjacency_matrix = None
+		self._reverse_adjacency = None
 
-	def shortest_path(self, starting_vertex, ending_vertex):
+		# Distances only change if the edge is a shortcut to vertex2
+		def stale(distances):
+			distance1 = distances[vertex1]
+			return distance1 != math.inf and distance1 + weight < distances[vertex2]
+		self._invalidate_shortest_paths(stale)
+
+	def _edge_removed(self, vertex1, vertex2, weight):
+		super()._edge_removed(vertex1, vertex2, weight)
+		self.shortest_paths_all = None
+		self.adjacency_matrix = None
+		self._reverse_adjacency = None
+
+		# Only an edge on some shortest path to vertex2 can matter
+		def stale(distances):
+			distance1 = distances[vertex1]
+			return distance1 != math.inf and distance1 + weight == distances[vertex2]
+		self._invalidate_shortest_paths(stale)
+
+	def _invalidate_shortest_paths(self, stale):
+		"""Drops the single-source results for which stale(distances) is True"""
+		if self.shortest_paths and stale(self.shortest_paths):
+			self.shortest_paths = None
+		for source, (distances, parents) in list(self._shortest_paths_cache.items()):
+			if stale(distances):
+				del self._shortest_paths_cache[source]
+
+	def iter_settled(self, starting_vertex):
+		"""
+		Dijkstra's algorithm as a generator of (vertex, distance) pairs, in the
+		order the verticies are settled, i.e. by increasing distance. Stop
+		iterating to end the search early; self.parents holds the shortest
+		path tree of the verticies yielded so far.
+		"""
+		assert not self.negative_edges, "Dijkstra's algorithm needs non-negative weights"
+
+		if self.storage == 'csr':
+			yield from self._csr_iter_settled(starting_vertex)
+			return
+
+		distances = {starting_vertex: 0}
+		self.parents = defaultdict(lambda: None, {starting_vertex: None})
+		settled = set()
+		to_be_processed = heap({starting_vertex: 0})
+		while to_be_processed:
+			vertex = to_be_processed.extract_min()
+			settled.add(vertex)
+			yield vertex, distances[vertex]
+			for adjacent_vertex, weight in self.adjacency_map[vertex].items():
+				if adjacent_vertex in settled:
+					continue
+				distance = distances[vertex] + weight
+				if distance < distances.get(adjacent_vertex, math.inf):
+					distances[adjacent_vertex] = distance
+					self.parents[adjacent_vertex] = vertex
+					to_be_processed[adjacent_vertex] = distance
+
+	def _csr_iter_settled(self, starting_vertex):
+		csr = self.csr
+		offsets, neighbors, weights, verticies = csr.offsets, csr.neighbors, csr.weights, csr.verticies
+		n = len(csr)
+		source = csr.vertex_to_id[starting_vertex]
+
+		distances = [math.inf] * n
+		parents = [ABSENT] * n
+		distances[source] = 0
+		parents[source] = None
+		self.parents = VertexMap(csr, parents, ids=True)
+		settled = bytearray(n)
+		to_be_processed = [(0, source)]
+		while to_be_processed:
+			d, u = heapq.heappop(to_be_processed)
+			if settled[u]:
+				continue
+			settled[u] = 1
+			yield verticies[u], d
+			for k in range(offsets[u], offsets[u + 1]):
+				v = neighbors[k]
+				if distances[v] > d + weights[k]:
+					distances[v] = d + weights[k]
+					parents[v] = u
+					heapq.heappush(to_be_processed, (distances[v], v))
+
+	def shortest_path(self, starting_vertex, ending_vertex, early_exit=False, return_path=False):
+		"""
+		early_exit - run Dijkstra's algorithm from starting_vertex only until
+		ending_vertex is settled, instead of computing every distance
+		return_path - return (distance, path), path being the list of
+		verticies from starting_vertex to ending_vertex, or None if there is
+		no path. Implies early_exit.
+		"""
 		assert starting_vertex in self.verticies, \
 		"Invalid starting vertex %s" % (starting_vertex)
 		assert ending_vertex in self.verticies, \
 		"Invalid ending vertex %s" % (ending_vertex)
 
+		if early_exit or return_path:
+			distance = self._search_to(starting_vertex, ending_vertex)
+			if distance is None:
+				distance = math.inf
+			if not return_path:
+				return distance
+			return distance, self._path_from_parents(starting_vertex, ending_vertex, distance)
+
 		# If all pairs shortest paths were calculated
 		if self.shortest_paths_all:
 			return self.shortest_paths_all[starting_vertex, ending_vertex]
 
-		# If haven't calculated shortest path from starting_vertex before
-		if not self.shortest_paths or self.shortest_paths[starting_vertex] != 0:
+		cached = self._shortest_paths_cache.get(starting_vertex)
+		if cached is None:
+			self.cache_misses += 1
 			self._single_source_shortest_paths(starting_vertex)
+			self._cache_shortest_paths(starting_vertex)
+		else:
+			self.cache_hits += 1
+			self._shortest_paths_cache.move_to_end(starting_vertex)
+			self.shortest_paths, self.parents = cached
 
 		return self.shortest_paths[ending_vertex]
 
-	def all_pairs_shortest_paths(self, johnson=False):
+	def _cache_shortest_paths(self, source):
+		cache = self._shortest_paths_cache
+		cache[source] = (self.shortest_paths, self.parents)
+		capacity = max(1, self.shortest_paths_cache_size // max(1, len(self.verticies)))
+		while len(cache) > capacity:
+			cache.popitem(last=False)
+
+	def bidirectional_shortest_path(self, starting_vertex, ending_vertex):
+		"""
+		Point to point Dijkstra run from both ends at once, the backward search
+		following the edges in reverse. Stops once the two searches can't
+		improve on the best connection found. Returns (distance, path) like
+		shortest_path(..., return_path=True); self.settled_count is the number
+		of verticies both searches settled.
+		"""
+		assert starting_vertex in self.verticies, \
+		"Invalid starting vertex %s" % (starting_vertex)
+		assert ending_vertex in self.verticies, \
+		"Invalid ending vertex %s" % (ending_vertex)
+		assert not self.negative_edges, "Dijkstra's algorithm needs non-negative weights"
+
+		# forward searches from starting_vertex, backward from ending_vertex
+		adjacency = {'forward': self.adjacency_map, 'backward': self._reverse_adjacency_map()}
+		distances = {'forward': {starting_vertex: 0}, 'backward': {ending_vertex: 0}}
+		parents = {'forward': {starting_vertex: None}, 'backward': {ending_vertex: None}}
+		settled = {'forward': set(), 'backward': set()}
+		to_be_processed = {'forward': heap({starting_vertex: 0}), 'backward': heap({ending_vertex: 0})}
+		other = {'forward': 'backward', 'backward': 'forward'}
+
+		best = 0 if starting_vertex == ending_vertex else math.inf
+		meeting_vertex = starting_vertex
+		while to_be_processed['forward'] and to_be_processed['backward']:
+			forward_min = to_be_processed['forward'][to_be_processed['forward'].find_min()]
+			backward_min = to_be_processed['backward'][to_be_processed['backward'].find_min()]
+			if forward_min + backward_min >= best:
+				break
+
+			# Grow the search with the smaller frontier
+			if len(to_be_processed['forward']) <= len(to_be_processed['backward']):
+				side = 'forward'
+			else:
+				side = 'backward'
+
+			vertex = to_be_processed[side].extract_min()
+			settled[side].add(vertex)
+			for adjacent_vertex, weight in adjacency[side][vertex].items():
+				if adjacent_vertex in settled[side]:
+					continue
+				distance = distances[side][vertex] + weight
+				if distance < distances[side].get(adjacent_vertex, math.inf):
+					distances[side][adjacent_vertex] = distance
+					parents[side][adjacent_vertex] = vertex
+					to_be_processed[side][adjacent_vertex] = distance
+
+				# Connection through the edge just scanned
+				if adjacent_vertex in distances[other[side]]:
+					total = distance + distances[other[side]][adjacent_vertex]
+					if total < best:
+						best = total
+						meeting_vertex = adjacent_vertex
+
+		self.settled_count = len(settled['forward']) + len(settled['backward'])
+		if best == math.inf:
+			return math.inf, None
+
+		path = [meeting_vertex]
+		while parents['forward'][path[-1]] is not None:
+			path.append(parents['forward'][path[-1]])
+		path.reverse()
+		while parents['backward'][path[-1]] is not None:
+			path.append(parents['backward'][path[-1]])
+
+		return best, path
+
+	def a_star(self, starting_vertex, ending_vertex, heuristic):
+		"""
+		A* search. heuristic(vertex, ending_vertex) must never overestimate the
+		distance from vertex to ending_vertex, e.g. euclidean_heuristic for
+		verticies with coordinates. Returns (distance, path) like
+		shortest_path(..., return_path=True); self.settled_count is the number
+		of verticies settled.
+		"""
+		assert starting_vertex in self.verticies, \
+		"Invalid starting vertex %s" % (starting_vertex)
+		assert ending_vertex in self.verticies, \
+		"Invalid ending vertex %s" % (ending_vertex)
+		assert not self.negative_edges, "A* needs non-negative weights"
+
+		distances = {starting_vertex: 0}
+		self.parents = defaultdict(lambda: None, {starting_vertex: None})
+		# Priorities are distance so far plus the estimate of the rest
+		to_be_processed = heap({starting_vertex: heuristic(starting_vertex, ending_vertex)})
+		self.settled_count = 0
+		while to_be_processed:
+			vertex = to_be_processed.extract_min()
+			self.settled_count += 1
+			if vertex == ending_vertex:
+				distance = distances[vertex]
+				return distance, self._path_from_parents(starting_vertex, ending_vertex, distance)
+
+			for adjacent_vertex, weight in self.adjacency_map[vertex].items():
+				distance = distances[vertex] + weight
+				if distance < distances.get(adjacent_vertex, math.inf):
+					distances[adjacent_vertex] = distance
+					self.parents[adjacent_vertex] = vertex
+					# Requeues a settled vertex if the heuristic is inconsistent
+					to_be_processed[adjacent_vertex] = distance + heuristic(adjacent_vertex, ending_vertex)
+
+		return math.inf, None
+
+	def _reverse_adjacency_map(self):
+		"""Maps every vertex to {vertex with an edge into it: weight}"""
+		if not self.is_directed:
+			return self.adjacency_map
+
+		if self._reverse_adjacency is None:
+			reversed_edges = ((vertex2, vertex1, weight) for vertex1, vertex2, weight in self.edges)
+			if self.storage == 'csr':
+				self._reverse_adjacency = CSRAdjacency(self.csr.verticies, reversed_edges, weighted=True)
+			else:
+				self._reverse_adjacency = defaultdict(dict)
+				for vertex1, vertex2, weight in reversed_edges:
+					self._reverse_adjacency[vertex1][vertex2] = weight
+
+		return self._reverse_adjacency
+
+	def all_pairs_shortest_paths(self, johnson=False, dtype=np.float64, as_dict=False, workers=None):
+		"""
+		Floyd-Warshall options:
+		dtype - np.float64, or np.float32 to halve the memory of the matrix
+		as_dict - store shortest_paths_all as a dict instead of a matrix view
+
+		Johnson options:
+		workers - number of processes to run the Dijkstra searches in
+		"""
 		if not johnson:
-			self._floyd_warshall()
+			self._floyd_warshall(dtype, as_dict)
 		else:
-			self._johnson()
+			self._johnson(workers)
+
+	def _floyd_warshall(self, dtype=np.float64, as_dict=False):
+		# Invalidated by add_vertices/add_edges/remove_edges
+		if self.adjacency_matrix is None:
+			self._setup_adjacency_matrix()
+
+		# A single matrix updated in place, the adjacency matrix stays intact
+		d = self.adjacency_matrix.astype(dtype)
+		n = len(d)
+		# Before any relaxation, the predecessor of j on the path i->j is i
+		predecessors = np.where(np.isfinite(d), np.arange(n, dtype=np.int32)[:, None], -1).astype(np.int32)
+		np.fill_diagonal(predecessors, -1)
 
-	def _floyd_warshall(self):
-		n = len(self.verticies)
-		d = {}
-		d[-1] = self.adjacency_matrix
 		for k in range(n):
-			d[k] = {}
-			for i in range(n):
-				for j in range(n):
-					d[k][i,j] = min(d[k - 1][i,j], d[k - 1][i,k] + d[k - 1][k,j])
+			self._floyd_warshall_step(d, predecessors, k)
+
+		if as_dict:
+			self.shortest_paths_all = self._convert_to_verticies(d)
+		else:
+			self.shortest_paths_all = VertexPairMatrix(self.ordered_verticies, d, predecessors)
 
-		self.shortest_paths_all = self._convert_to_verticies(d[n - 1])
+	def _floyd_warshall_step(self, d, predecessors, k):
+		"""Relaxes every path through vertex k, i.e. d = min(d, d[:,k] + d[k,:])"""
+		through_k = d[:, k, None] + d[None, k, :]
+		improved = through_k < d
+		np.copyto(d, through_k, where=improved)
+		# The path i->k->j ends like the path k->j
+		np.copyto(predecessors, predecessors[k], where=improved)
 
-	def _johnson(self):
-		class SourceVertex:
-			def __lt__(self, other):
-				return True
+	def _johnson(self, workers=None):
+		csr = self._johnson_csr()
+		n = len(csr)
 
-			def __repr__(self):
-				return "SourceVertex"
+		# Rows are streamed into a single matrix instead of a (u,v) dict
+		d = np.empty((n, n))
+		for source, row in self._johnson_rows(csr, workers):
+			d[source] = np.frombuffer(row)
 
-		# Calculate a new graph that has a new source node connecting to all
-		# existing nodes with weight 0. Used to reweight edges
+		self.shortest_paths_all = VertexPairMatrix(csr.verticies, d)
 
-		s = SourceVertex()
+	def iter_all_pairs_shortest_paths(self, workers=None):
+		"""
+		Johnson's algorithm, yielding (source, distances) one source at a time
+		so the V^2 distances never have to be held at once. distances maps
+		every vertex to its distance from source.
+		"""
+		csr = self._johnson_csr()
+		for source, row in self._johnson_rows(csr, workers):
+			yield csr.verticies[source], VertexMap(csr, row, math.inf)
 
-		temp_verticies = self.verticies | {s}
-		temp_edges = set(i for i in self.edges)
-		for vertex in self.verticies:
-			temp_edges |= {(s, vertex, 0)}
-		temp_graph = WeightedGraph(temp_verticies, temp_edges)
+	def _johnson_csr(self):
+		if self.storage == 'csr':
+			return self.csr
+		return CSRAdjacency(self.verticies, self.edges, weighted=True)
 
-		# Bellman ford on source to detect negative edges and to find shortest
-		# paths from source to calculate h function
-		temp_graph._initialize_single_source(s)
-		try:
-			temp_graph._bellman_ford(s)
-		except NegativeCycleException:
-			raise
-
-		# Function of the vertex that will aid in reweighting
-		h = {}
-		for vertex in temp_graph.verticies:
-			h[vertex] = temp_graph.shortest_path(s, vertex)
-
-		new_weights = {}
-		for vertex1, vertex2, weight in temp_graph.edges:
-			new_weights[vertex1, vertex2] = weight + h[vertex1] - h[vertex2]
-
-		# Matrix that contains final answer
-		d = {}
-		for vertex1 in self.verticies:
-			self._single_source_shortest_paths(vertex1)
-			for vertex2 in self.verticies:
-				d[vertex1, vertex2] = self.shortest_path(vertex1, vertex2) - h[vertex1] + h[vertex2]
+	def _johnson_rows(self, csr, workers=None):
+		"""
+		Yields (source id, distances by id) for every vertex. Edges are
+		reweighted with h(u) - h(v) to be non-negative, h being the distances
+		from a virtual source with a zero weight edge to every vertex, so each
+		row is one Dijkstra run. With workers, the runs are spread over a
+		process pool that reads the reweighted graph from shared memory.
+		"""
+		n = len(csr)
+		offsets, neighbors = csr.offsets, csr.neighbors
+
+		# Bellman-Ford from the virtual source: every vertex starts at 0
+		h = [0] * n
+		negative_cycle = _bellman_ford_ids(offsets, neighbors, csr.weights, h, [None] * n)
+		if negative_cycle:
+			cycle = [csr.verticies[u] for u in negative_cycle]
+			raise NegativeCycleException(set(cycle), cycle)
+
+		sources = csr.edge_sources()
+		weights = array('d', (csr.weights[k] + h[sources[k]] - h[neighbors[k]]
+			for k in range(len(neighbors))))
+		h = array('d', h)
+
+		if not workers:
+			graph = (None, offsets, neighbors, weights, h)
+			for source in range(n):
+				yield source, _johnson_row(source, graph)
+			return
 
-		self.shortest_paths_all = d
+		m = len(neighbors)
+		block = shared_memory.SharedMemory(create=True, size=max(8 * (2 * n + 1 + 2 * m), 1))
+		try:
+			position = 0
+			for part in (array('q', offsets), array('q', neighbors), weights, h):
+				data = part.tobytes()
+				block.buf[position:position + len(data)] = data
+				position += len(data)
+
+			with ProcessPoolExecutor(workers, initializer=_attach_johnson_graph,
+				initargs=(block.name, n, m)) as executor:
+				chunksize = max(1, n // (4 * workers))
+				for source, row in enumerate(executor.map(_johnson_row, range(n), chunksize=chunksize)):
+					yield source, row
+		finally:
+			block.close()
+			block.unlink()
 
 	def _convert_to_verticies(self, d):
 		"""Converts a matrix representation back to the given names for the verticies"""
@@ -383,39 +2051,44 @@ class WeightedGraph(Graph):
 				self._relax(vertex1, vertex2, weight)
 
 	def _bellman_ford(self, source):
-		for i in range(len(self.verticies) - 1):
-			for edge in self.edges:
-				self._relax(*edge)
-
-		# If any edges can still be relax, a negative weight cycle exists
-		has_negative_cycle = False
-		negative_cycle_verticies = set()
-		for vertex1, vertex2, weight in self.edges:
-			if self._distance_estimates[vertex2] > self._distance_estimates[vertex1] + weight:
-				has_negative_cycle = True
-				self._distance_estimates[vertex2] = self.NEG_INFINITY
-				negative_cycle_verticies.add(vertex2)
-
-		# Adds information if there is a negative cycle
-		if has_negative_cycle:
-			# Find a vertex that is part of a negative cycle
-			for vertex, distance in self._distance_estimates.items():
-				if distance != self.NEG_INFINITY:
-					continue
-				# Set the predecessors of that vertex to -infinity, while loop terminates
-				# when the entire cycle is set to -infinity; i.e. predecessor is also
-				# -infinity. Also adds each vertex of cycle to negative_cycle_verticies
-				while self._distance_estimates[self.parents[vertex]] != self.NEG_INFINITY:
-					vertex = self.parents[vertex]
-					negative_cycle_verticies.add(vertex)
-					self._distance_estimates[vertex] = self.NEG_INFINITY
+		adjacent = self._weighted_adjacent()
+		if self.storage == 'csr':
+			verticies = range(len(self.csr))
+			distances = self._distance_estimates.values_by_id
+			parents = self.parents.values_by_id
+		else:
+			verticies = list(self.verticies)
+			distances = self._distance_estimates
+			parents = self.parents
+
+		search = _spfa if self.bellman_ford_queue else _bellman_ford_passes
+		cycle = search(verticies, adjacent, distances, parents)
+		if cycle:
+			for vertex in cycle:
+				distances[vertex] = self.NEG_INFINITY
+			if self.storage == 'csr':
+				cycle = [self.csr.verticies[u] for u in cycle]
+			raise NegativeCycleException(set(cycle), cycle)
 
-				break
+	def _dijkstra(self, source):
+		queue = self.dijkstra_queue
+		if queue is None:
+			if self.max_integer_weight is None:
+				queue = 'heap'
+			elif self.max_integer_weight <= self.dial_max_weight:
+				queue = 'dial'
+			else:
+				queue = 'radix' if self.storage == 'map' else 'heap'
+		assert queue in ('heap', 'dial', 'radix'), "Unknown priority queue: %s" % (queue)
+		if queue != 'heap':
+			assert self.max_integer_weight is not None, "%s needs non-negative integer weights" % (queue)
+			self._integer_dijkstra(source, queue)
+			return
 
-		if has_negative_cycle:
-			raise NegativeCycleException(negative_cycle_verticies)
+		if self.storage == 'csr':
+			self._csr_dijkstra(source)
+			return
 
-	def _dijkstra(self, source):
 		# Reverse dict.items so it is compared by value (weights)
 		to_be_processed = heap(item for item in self._distance_estimates.items())
 		while to_be_processed:
@@ -424,9 +2097,49 @@ class WeightedGraph(Graph):
 			for adjacent_vertex, weight in self.adjacency_map[vertex].items():
 				self._relax(vertex, adjacent_vertex, weight, to_be_processed)
 
+	def _weighted_adjacent(self):
+		"""adjacent(u), giving the (v, weight) pairs of the edges leaving u.
+		For the csr storage u and v are vertex ids."""
+		if self.storage == 'csr':
+			offsets, neighbors, weights = self.csr.offsets, self.csr.neighbors, self.csr.weights
+			def adjacent(u):
+				return zip(neighbors[offsets[u]:offsets[u + 1]], weights[offsets[u]:offsets[u + 1]])
+		else:
+			def adjacent(u):
+				return self.adjacency_map[u].items()
+		return adjacent
+
+	def _integer_dijkstra(self, source, queue):
+		adjacent = self._weighted_adjacent()
+		if self.storage == 'csr':
+			source = self.csr.vertex_to_id[source]
+			distances = self._distance_estimates.values_by_id
+			parents = self.parents.values_by_id
+		else:
+			distances = self._distance_estimates
+			parents = self.parents
+
+		if queue == 'dial':
+			_dial(adjacent, source, distances, parents, self.max_integer_weight)
+		else:
+			max_distance = max(1, self.max_integer_weight) * len(self.verticies)
+			_radix_heap(adjacent, source, distances, parents, max_distance)
+
+	def _csr_dijkstra(self, source):
+		csr = self.csr
+		_dijkstra_ids(csr.offsets, csr.neighbors, csr.weights, csr.vertex_to_id[source],
+			self._distance_estimates.values_by_id, self.parents.values_by_id)
+
 	def _initialize_single_source(self, source):
 		self.INFINITY = math.inf
 		self.NEG_INFINITY = -math.inf
+
+		if self.storage == 'csr':
+			n = len(self.csr)
+			self._distance_estimates = VertexMap(self.csr, [self.INFINITY] * n, self.INFINITY)
+			self.parents = VertexMap(self.csr, [None] * n, ids=True)
+			self._distance_estimates[source] = 0
+			return
 		self._distance_estimates = defaultdict(lambda: self.INFINITY)
 		self.parents = defaultdict(lambda: None)
 
@@ -445,23 +2158,71 @@ class WeightedGraph(Graph):
 			self.parents[vertex2] = vertex1
 
 	def kruskal(self):
-		A = set()
-		D = DisjointSet()
-		for vertex in self.verticies:
-			D.new_set(vertex)
+		if self.storage == 'csr':
+			return self._csr_kruskal()
+
+		verticies = list(self.verticies)
+		vertex_to_id = {vertex: i for i, vertex in enumerate(verticies)}
+		sources, targets, weights = [], [], []
+		D = DisjointSetArray(len(verticies))
 		sorted_edges = sorted(self.edges, key=lambda edge: edge[2])
 		for vertex1, vertex2, weight in sorted_edges:
-			v1 = D.find(vertex1)
-			v2 = D.find(vertex2)
+			u, v = vertex_to_id[vertex1], vertex_to_id[vertex2]
+			root1 = D.find_id(u)
+			root2 = D.find_id(v)
 			# Not in same connected component
-			if v1 != v2:
-				A |= {(vertex1, vertex2, weight)}
-				D.union(v1, v2)
-		return A
+			if root1 != root2:
+				sources.append(u)
+				targets.append(v)
+				weights.append(weight)
+				D.union(root1, root2)
+		return SpanningForest(verticies, sources, targets, weights)
+
+	def _csr_kruskal(self):
+		csr = self.csr
+		weights = np.asarray(csr.weights)
+		sources = csr.edge_sources()
+		forest = array('q')
+		D = DisjointSetArray(len(csr))
+		for k in np.argsort(weights, kind='stable').tolist():
+			u, v = sources[k], csr.neighbors[k]
+			root1 = D.find_id(u)
+			root2 = D.find_id(v)
+			if root1 != root2:
+				forest.append(k)
+				D.union(root1, root2)
+		forest = np.asarray(forest, dtype=np.int64)
+		return SpanningForest(csr.verticies, np.asarray(sources)[forest],
+			np.asarray(csr.neighbors, dtype=np.int64)[forest], weights[forest])
+
+	def boruvka(self):
+		"""
+		Minimum spanning forest by Borůvka's algorithm, with each round's
+		search for the cheapest edges done by NumPy over the CSR arrays
+		(built from the map for the map storage). Like kruskal, edges are
+		taken as undirected.
+		"""
+		csr = self._johnson_csr()
+		n = len(csr)
+		offsets = np.asarray(csr.offsets, dtype=np.int64)
+		sources = np.repeat(np.arange(n), np.diff(offsets))
+		targets = np.asarray(csr.neighbors, dtype=np.int64)
+		weights = np.asarray(csr.weights)
+		if not self.is_directed:
+			# Both directions of an undirected edge are stored; keep one
+			once = np.flatnonzero(sources < targets)
+			sources, targets, weights = sources[once], targets[once], weights[once]
+
+		forest = _boruvka_ids(n, sources, targets, weights)
+		return SpanningForest(csr.verticies, sources[forest], targets[forest], weights[forest])
 
 	def prim(self, source):
 		assert source in self.verticies
 
+		if self.storage == 'csr':
+			self._csr_prim(source)
+			return
+
 		distances = {}
 		self.MST_parents = {}
 		for vertex in self.verticies:	
@@ -478,10 +2239,44 @@ class WeightedGraph(Graph):
 					distances[adjacent_vertex] = weight
 					to_be_processed[adjacent_vertex] = weight
 
+	def _csr_prim(self, source):
+		csr = self.csr
+		offsets, neighbors, weights = csr.offsets, csr.neighbors, csr.weights
+		n = len(csr)
+		distances = [math.inf] * n
+		MST_parents = [None] * n
+		in_tree = bytearray(n)
+
+		start = csr.vertex_to_id[source]
+		distances[start] = 0
+		# Verticies unreachable from source start new trees, as the infinite
+		# keys do in prim, so the result is a spanning forest
+		for root in [start] + list(range(n)):
+			if in_tree[root]:
+				continue
+			to_be_processed = [(distances[root], root)]
+			while to_be_processed:
+				d, u = heapq.heappop(to_be_processed)
+				if in_tree[u]:
+					continue
+				in_tree[u] = 1
+				for k in range(offsets[u], offsets[u + 1]):
+					v = neighbors[k]
+					if not in_tree[v] and weights[k] < distances[v]:
+						MST_parents[v] = u
+						distances[v] = weights[k]
+						heapq.heappush(to_be_processed, (weights[k], v))
+
+		self.MST_parents = VertexMap(csr, MST_parents, ids=True)
+
 class FlowNetwork(Graph):
+	# Residual network of the last max_flow, see _setup_residual
+	_residual_capacity = None
+
 	def __init__(self, verticies=(), edges=(), source=None, sink=None):
 		"""
-		edges - (vertex1, vertex2, capacity)
+		edges - (vertex1, vertex2, capacity) or (vertex1, vertex2, capacity, cost).
+		Costs are only used by min_cost_flow and default to 0.
 		source, sink - can be an iterable for multiple sources/sinks
 		"""
 		self.verticies = set(verticies)
@@ -497,17 +2292,19 @@ class FlowNetwork(Graph):
 
 	def _setup_adjacency_map(self):
 		self.adjacency_map = defaultdict(dict)
+		self.costs = {}
 
-		for vertex1, vertex2, capacity in self.edges:
+		for edge in self.edges:
+			vertex1, vertex2, capacity = edge[:3]
 			assert vertex1 in self.verticies, "Undefined vertex: %s" % (vertex1)
 			assert vertex2 in self.verticies, "Undefined vertex: %s" % (vertex2)
 			assert capacity >= 0, "Capacity must be positive"
 
 			self.adjacency_map[vertex1][vertex2] = capacity
+			if len(edge) == 4:
+				self.costs[vertex1, vertex2] = edge[3]
 
 	def _setup_network(self, source, sink):
-		#### ALSO FIX ANTI-PARALLEL EDGES #####
-
 		class Sentinel:
 			def __init__(self, type='source'):
 				self.type = type
@@ -525,7 +2322,7 @@ class FlowNetwork(Graph):
 			supersource = Sentinel()
 			self.verticies.add(supersource)
 			for s in source:
-				assert source in self.verticies
+				assert s in self.verticies
 				self.adjacency_map[supersource][s] = math.inf
 			self.source = supersource
 
@@ -538,79 +2335,577 @@ class FlowNetwork(Graph):
 			supersink = Sentinel("sink")
 			self.verticies.add(supersink)
 			for t in sink:
-				assert sink in self.verticies
-				self.adjacency_map[s][supersource] = math.inf
+				assert t in self.verticies
+				self.adjacency_map[t][supersink] = math.inf
 			self.sink = supersink
 
-	def max_flow(self):
-		self._edmonds_karp()
+	def max_flow(self, algorithm='dinic'):
+		"""
+		algorithm - 'dinic', 'push_relabel' (highest label first) or
+		'edmonds_karp'. All of them work in place on one residual network of
+		flat arrays (see _setup_residual); self.flow is a view of it.
+		"""
+		assert algorithm in ('dinic', 'push_relabel', 'edmonds_karp'), \
+		"Unknown max flow algorithm: %s" % (algorithm)
+
+		self._setup_residual()
+		if algorithm == 'dinic':
+			self._dinic()
+		elif algorithm == 'push_relabel':
+			self._push_relabel()
+		else:
+			self._edmonds_karp()
+		self.flow = EdgeFlows(self._flow_edges, self._residual_capacity)
 
+		# Net flow out of the (super)source, arcs into it being odd
 		max_flow = 0
-		# One source
-		if not hasattr(self.source, '_sentinel_class'):
-			for vertex in self.adjacency_map[self.source]:
-				max_flow += self.flow[self.source, vertex]
+		residual = self._residual_capacity
+		s = self._source_id
+		for k in self._arcs[self._arc_offsets[s]:self._arc_offsets[s + 1]]:
+			max_flow += residual[k ^ 1] if k % 2 == 0 else -residual[k]
+
+		return max_flow
 
-		# Multiple sources
+	def min_cut(self):
+		"""
+		Minimum cut, from the residual network left by the last max_flow (which
+		is run first if there was none). Returns (source_side, cut_edges):
+		the verticies still reachable from the source in the residual network,
+		and the edges leaving them, all of which are saturated.
+		"""
+		if self._residual_capacity is None:
+			self.max_flow()
+
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		reached = bytearray(len(self._flow_verticies))
+		reached[self._source_id] = 1
+		queue = [self._source_id]
+		for u in queue:
+			for k in arcs[offsets[u]:offsets[u + 1]]:
+				v = heads[k]
+				if residual[k] > 0 and not reached[v]:
+					reached[v] = 1
+					queue.append(v)
+
+		source_side = set(self._flow_verticies[u] for u in queue
+			if not hasattr(self._flow_verticies[u], '_sentinel_class'))
+		cut_edges = []
+		for i, (vertex1, vertex2) in enumerate(self._flow_edges):
+			if reached[heads[2 * i + 1]] and not reached[heads[2 * i]]:
+				cut_edges.append((vertex1, vertex2))
+
+		return source_side, cut_edges
+
+	def min_cost_flow(self, amount=None):
+		"""
+		Sends amount units of flow (the maximum flow if None) from the source
+		to the sink at the least total cost, costs being the fourth element of
+		the edges. Returns (flow, cost); self.flow holds the flow of every edge.
+
+		Successive shortest paths with capacity scaling: in the phase for
+		delta (a power of two, halved every phase) only residual arcs with at
+		least delta capacity are used, so large integer capacities take few
+		augmentations. Potentials keep the reduced costs of those arcs
+		non-negative for Dijkstra; arcs that are negative at the start of a
+		phase are saturated first, which also handles negative costs.
+
+		A bypass edge from the source to the sink, costing more than any path,
+		takes whatever the network can't carry, so no max flow has to be
+		computed first; with amount None, the source offers all the capacity
+		leaving it. Raises InfeasibleFlow if part of amount is left on the
+		bypass.
+		"""
+		assert amount is None or amount >= 0, "Can't send a negative amount"
+		self._setup_residual(bypass=True)
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		costs = self._arc_costs
+		n = len(self._flow_verticies)
+		source, sink = self._source_id, self._sink_id
+		bypass = len(self._flow_edges) - 1
+
+		offered = amount
+		if offered is None:
+			offered = sum(residual[k] for k in arcs[offsets[source]:offsets[source + 1]])
+		residual[2 * bypass] = offered
+
+		excess = [0] * n
+		excess[source] = offered
+		excess[sink] = -offered
+		potentials = [0] * n
+
+		if residual.typecode == 'q':
+			delta = 1
+			while 2 * delta <= max(residual, default=0):
+				delta *= 2
 		else:
-			for subsource in self.adjacency_map[self.source]:
-				for vertex in self.adjacency_map[subsource]:
-					# If not a another subsource
-					if vertex not in self.adjacency_map[self.source]:
-						max_flow += self.flow[subsource, vertex]
+			# No scaling for float capacities, one phase using every arc
+			delta = 0
 
-		return max_flow
+		while True:
+			# Arcs usable in this phase have residual capacity above 'low'
+			low = delta - 1 if delta else 0
+
+			for u in range(n):
+				for k in arcs[offsets[u]:offsets[u + 1]]:
+					v = heads[k]
+					if residual[k] > low and costs[k] - potentials[u] + potentials[v] < 0:
+						pushed = residual[k]
+						residual[k] = 0
+						residual[k ^ 1] += pushed
+						excess[u] -= pushed
+						excess[v] += pushed
+
+			while self._min_cost_augment(excess, potentials, low):
+				pass
+
+			if delta <= 1:
+				break
+			delta //= 2
+
+		unrouted = residual[2 * bypass + 1]
+		# The residual network has the bypass in it and isn't a max flow, so
+		# min_cut must not reuse it
+		self._residual_capacity = None
+		if amount is not None and unrouted:
+			raise InfeasibleFlow("Can't send %s units, only %s reach the sink" % (amount, amount - unrouted))
+
+		self.flow = EdgeFlows(self._flow_edges[:bypass], residual)
+		cost = sum(costs[2 * i] * residual[2 * i + 1] for i in range(bypass))
+		return offered - unrouted, cost
+
+	def _min_cost_augment(self, excess, potentials, low):
+		"""
+		Dijkstra on reduced costs from every vertex with excess above low to
+		the nearest one with a deficit above low, using arcs with residual
+		capacity above low. Updates the potentials, augments along the path
+		and returns True, or returns False if there is no such path.
+		"""
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		costs = self._arc_costs
+		n = len(self._flow_verticies)
+
+		distances = [math.inf] * n
+		parent_arcs = [-1] * n
+		to_be_processed = []
+		for u in range(n):
+			if excess[u] > low:
+				distances[u] = 0
+				to_be_processed.append((0, u))
+		if not to_be_processed or not any(e < -low for e in excess):
+			return False
+
+		settled = bytearray(n)
+		target = -1
+		while to_be_processed:
+			d, u = heapq.heappop(to_be_processed)
+			if settled[u]:
+				continue
+			settled[u] = 1
+			if excess[u] < -low:
+				target = u
+				break
+			for k in arcs[offsets[u]:offsets[u + 1]]:
+				v = heads[k]
+				if residual[k] > low:
+					distance = d + costs[k] - potentials[u] + potentials[v]
+					if distance < distances[v]:
+						distances[v] = distance
+						parent_arcs[v] = k
+						heapq.heappush(to_be_processed, (distance, v))
+		if target == -1:
+			return False
+
+		# Capping at the target's distance keeps every reduced cost non-negative
+		limit = distances[target]
+		for u in range(n):
+			potentials[u] -= min(distances[u], limit)
+
+		path = []
+		v = target
+		while parent_arcs[v] != -1:
+			k = parent_arcs[v]
+			path.append(k)
+			v = heads[k ^ 1]
+		pushed = min([excess[v], -excess[target]] + [residual[k] for k in path])
+		for k in path:
+			residual[k] -= pushed
+			residual[k ^ 1] += pushed
+		excess[v] -= pushed
+		excess[target] += pushed
+		return True
+
+	def _setup_residual(self, bypass=False):
+		"""
+		Residual network over integer vertex ids. Edge i of _flow_edges is
+		arc 2i and its reverse is arc 2i + 1, so the reverse of arc k is
+		k ^ 1. _residual_capacity[k] is updated in place as flow is pushed,
+		and the arcs leaving vertex u are _arcs[_arc_offsets[u]:_arc_offsets[u + 1]].
+
+		bypass - add a last edge from the source to the sink, with no capacity
+		and a cost above that of any path, for min_cost_flow
+		"""
+		self._flow_verticies = list(self.verticies)
+		vertex_to_id = {vertex: i for i, vertex in enumerate(self._flow_verticies)}
+		self._flow_edges = [(vertex1, vertex2) for vertex1, adjacent in self.adjacency_map.items()
+			for vertex2 in adjacent]
+
+		# No flow exceeds the sum of the finite capacities, so infinite
+		# (sentinel) edges given one more than it are never saturated and
+		# never end up in a min cut
+		bound = 1 + sum(capacity for adjacent in self.adjacency_map.values()
+			for capacity in adjacent.values() if capacity != math.inf)
+
+		n = len(self._flow_verticies)
+		heads = array('q')
+		capacities = []
+		for vertex1, vertex2 in self._flow_edges:
+			capacity = self.adjacency_map[vertex1][vertex2]
+			heads.append(vertex_to_id[vertex2])
+			heads.append(vertex_to_id[vertex1])
+			capacities.append(bound if capacity == math.inf else capacity)
+			capacities.append(0)
+		self._arc_costs = []
+		for edge in self._flow_edges:
+			cost = self.costs.get(edge, 0)
+			self._arc_costs.append(cost)
+			self._arc_costs.append(-cost)
+
+		if bypass:
+			self._flow_edges.append((self.source, self.sink))
+			heads.append(vertex_to_id[self.sink])
+			heads.append(vertex_to_id[self.source])
+			capacities += [0, 0]
+			cost = 1 + sum(abs(cost) for cost in self._arc_costs[::2])
+			self._arc_costs += [cost, -cost]
+
+		# Keep integer capacities as integers, like CSRAdjacency does weights
+		typecode = 'q' if all(isinstance(c, int) for c in capacities) else 'd'
+		capacities = array(typecode, capacities)
+
+		# Counting sort of the arcs by tail, the tail of arc k being heads[k ^ 1]
+		offsets = array('q', bytes(8 * (n + 1)))
+		for k in range(len(heads)):
+			offsets[heads[k ^ 1] + 1] += 1
+		for i in range(n):
+			offsets[i + 1] += offsets[i]
+		cursor = array('q', offsets[:-1])
+		arcs = array('q', bytes(8 * len(heads)))
+		for k in range(len(heads)):
+			u = heads[k ^ 1]
+			arcs[cursor[u]] = k
+			cursor[u] += 1
+
+		self._arc_heads = heads
+		self._arc_offsets = offsets
+		self._arcs = arcs
+		self._residual_capacity = capacities
+		self._source_id = vertex_to_id[self.source]
+		self._sink_id = vertex_to_id[self.sink]
+
+	def _dinic(self):
+		"""
+		Dinic's algorithm: repeatedly builds the BFS level graph of the
+		residual network and saturates it with a blocking flow, found by
+		depth first searches that never revisit a dead end arc.
+		"""
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		n = len(self._flow_verticies)
+		s, t = self._source_id, self._sink_id
 
-	def _edmonds_karp(self):
-		for vertex1, vertex2, capacity in self.edges:
-			self.flow[vertex1, vertex2] = 0
-		
 		while True:
-			residual_network = self._construct_residual_network()
-			try:
-				residual_capacity = self._find_augmenting_path(residual_network)
-			except NoPathFound:
+			level = [-1] * n
+			level[s] = 0
+			queue = [s]
+			for u in queue:
+				for k in arcs[offsets[u]:offsets[u + 1]]:
+					v = heads[k]
+					if residual[k] > 0 and level[v] == -1:
+						level[v] = level[u] + 1
+						queue.append(v)
+			if level[t] == -1:
 				break
 
-			for vertex1, vertex2 in self.residual_path:
-				if vertex2 in self.adjacency_map[vertex1]:
-					self.flow[vertex1, vertex2] += residual_capacity
+			# Current arc of every vertex; arcs before it are saturated or lead
+			# to dead ends
+			current = array('q', offsets[:-1])
+			path = []
+			u = s
+			while True:
+				if u == t:
+					pushed = min(residual[k] for k in path)
+					for k in path:
+						residual[k] -= pushed
+						residual[k ^ 1] += pushed
+					# Resume from the tail of the first saturated arc
+					for i, k in enumerate(path):
+						if residual[k] == 0:
+							del path[i:]
+							break
+					u = heads[path[-1]] if path else s
+					continue
+
+				end = offsets[u + 1]
+				k = -1
+				while current[u] < end:
+					k = arcs[current[u]]
+					v = heads[k]
+					if residual[k] > 0 and level[v] == level[u] + 1:
+						break
+					current[u] += 1
+				if current[u] < end:
+					path.append(k)
+					u = v
+					continue
+
+				# Dead end, remove u from the level graph
+				level[u] = -1
+				if u == s:
+					break
+				k = path.pop()
+				u = heads[k ^ 1]
+				current[u] += 1
+
+	def _push_relabel(self):
+		"""
+		Push-relabel, always discharging an active vertex of the highest label,
+		with an initial global relabeling from the sink and the gap heuristic.
+		Excess that can't reach the sink is pushed back to the source, so the
+		result is a flow and not just a preflow.
+		"""
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		n = len(self._flow_verticies)
+		s, t = self._source_id, self._sink_id
+
+		# Global relabeling: labels are the BFS distances to the sink
+		label = [n] * n
+		label[t] = 0
+		queue = [t]
+		for v in queue:
+			for k in arcs[offsets[v]:offsets[v + 1]]:
+				u = heads[k]
+				if residual[k ^ 1] > 0 and label[u] == n:
+					label[u] = label[v] + 1
+					queue.append(u)
+		label[s] = n
+
+		excess = [0] * n
+		for k in arcs[offsets[s]:offsets[s + 1]]:
+			pushed = residual[k]
+			residual[k] = 0
+			residual[k ^ 1] += pushed
+			excess[heads[k]] += pushed
+		# Float capacities can leave rounding errors of excess this large
+		tolerance = 1e-9 * sum(excess) if residual.typecode == 'd' else 0
+
+		# active[h] = verticies with label h and positive excess;
+		# count[h] = number of verticies with label h
+		active = [[] for i in range(2 * n)]
+		count = [0] * (2 * n)
+		for u in range(n):
+			count[label[u]] += 1
+			if excess[u] > 0 and u != s and u != t:
+				active[label[u]].append(u)
+		current = array('q', offsets[:-1])
+		highest = n
+
+		while highest >= 0:
+			if not active[highest]:
+				highest -= 1
+				continue
+			u = active[highest].pop()
+			if label[u] != highest or excess[u] == 0:
+				continue
+
+			# Discharge u
+			end = offsets[u + 1]
+			while excess[u] > 0:
+				if current[u] == end:
+					# Relabel
+					old_label = label[u]
+					new_label = 2 * n
+					for k in arcs[offsets[u]:end]:
+						if residual[k] > 0 and label[heads[k]] + 1 < new_label:
+							new_label = label[heads[k]] + 1
+					if new_label == 2 * n:
+						# Labels never exceed 2n - 1: with exact arithmetic the
+						# reverse of the arcs that brought the excess lead back
+						# to the source. Only rounding errors can be stranded.
+						assert excess[u] <= tolerance, "Flow conservation violated at %s by %s" \
+							% (self._flow_verticies[u], excess[u])
+						excess[u] = 0
+						break
+					count[old_label] -= 1
+					label[u] = new_label
+					count[new_label] += 1
+					current[u] = offsets[u]
+
+					# Gap: nothing labeled old_label is left, so the verticies
+					# above it (below n) can't reach the sink any more
+					if old_label < n and count[old_label] == 0:
+						for v in range(n):
+							if old_label < label[v] < n:
+								count[label[v]] -= 1
+								label[v] = n + 1
+								count[n + 1] += 1
+								current[v] = offsets[v]
+								if excess[v] > 0 and v != s and v != t:
+									active[n + 1].append(v)
+						highest = max(highest, n + 1)
+					continue
+
+				k = arcs[current[u]]
+				v = heads[k]
+				if residual[k] > 0 and label[u] == label[v] + 1:
+					pushed = min(excess[u], residual[k])
+					residual[k] -= pushed
+					residual[k ^ 1] += pushed
+					excess[u] -= pushed
+					if excess[v] == 0 and v != s and v != t:
+						active[label[v]].append(v)
+						highest = max(highest, label[v])
+					excess[v] += pushed
 				else:
-					self.flow[vertex2, vertex1] -= residual_capacity
+					current[u] += 1
 
-	def _construct_residual_network(self):
-		residual_edges = set()
-		
-		for vertex1 in self.verticies:
-			for vertex2, capacity in self.adjacency_map[vertex1].items():
-				flow = self.flow[vertex1, vertex2]
-				if flow < capacity:
-					residual_edges.add((vertex1, vertex2, capacity - flow))
-				if flow > 0:
-					residual_edges.add((vertex2, vertex1, flow))
+	def _edmonds_karp(self):
+		"""Augments along shortest residual paths, found by BFS, until there are none"""
+		heads, offsets, arcs = self._arc_heads, self._arc_offsets, self._arcs
+		residual = self._residual_capacity
+		n = len(self._flow_verticies)
+		s, t = self._source_id, self._sink_id
 
-		return FlowNetwork(self.verticies, residual_edges, self.source, self.sink)
+		while True:
+			# Arc into every vertex reached by the BFS
+			parent_arcs = array('q', [-1]) * n
+			parent_arcs[s] = n
+			queue = [s]
+			for u in queue:
+				for k in arcs[offsets[u]:offsets[u + 1]]:
+					v = heads[k]
+					if residual[k] > 0 and parent_arcs[v] == -1:
+						parent_arcs[v] = k
+						queue.append(v)
+				if parent_arcs[t] != -1:
+					break
+			if parent_arcs[t] == -1:
+				break
 
-	def _find_augmenting_path(self, residual_network):
-		residual_network.breadth_first_search(self.source)
+			path = []
+			v = t
+			while v != s:
+				k = parent_arcs[v]
+				path.append(k)
+				v = heads[k ^ 1]
+			residual_capacity = min(residual[k] for k in path)
+			for k in path:
+				residual[k] -= residual_capacity
+				residual[k ^ 1] += residual_capacity
+
+def bipartite_matching(left, right, edges):
+	"""
+	Maximum matching of a bipartite graph by Hopcroft-Karp, in O(E sqrt(V)).
+	Its size is the max flow of a FlowNetwork with unit capacity edges from
+	a source to 'left', along 'edges' and from 'right' to a sink, without
+	the generic max flow machinery.
 
-		if not residual_network.parents[self.sink]:
-			raise NoPathFound
-		else:
-			curr_node = self.sink
-			prev_node = residual_network.parents[self.sink]
+	left, right - disjoint iterables of verticies
+	edges - (u, v) tuples with u in left and v in right
+
+	Returns (matching, cover): the dict {u: v} of matched pairs, and a
+	minimum vertex cover (as large as the matching, by Konig's theorem).
+	"""
+	left = list(left)
+	right = list(right)
+	left_id = {vertex: i for i, vertex in enumerate(left)}
+	right_id = {vertex: i for i, vertex in enumerate(right)}
+	assert not left_id.keys() & right_id.keys(), "left and right must be disjoint"
+	csr = CSRAdjacency(range(len(left) + len(right)),
+		((left_id[u], len(left) + right_id[v]) for u, v in edges))
+	offsets, neighbors = csr.offsets, csr.neighbors
+
+	n = len(left)
+	# Right verticies are ids n.. of the CSR arrays
+	match_left = array('q', [-1]) * n
+	match_right = array('q', [-1]) * (len(right) + n)
+	infinity = len(left) + 1
+
+	while True:
+		# BFS layers of left verticies from the free ones, along alternating
+		# paths, up to the length of the shortest augmenting path
+		distances = array('q', [infinity]) * n
+		queue = [u for u in range(n) if match_left[u] == -1]
+		for u in queue:
+			distances[u] = 0
+		shortest = infinity
+		for u in queue:
+			if distances[u] >= shortest:
+				break
+			for v in neighbors[offsets[u]:offsets[u + 1]]:
+				w = match_right[v]
+				if w == -1:
+					shortest = min(shortest, distances[u] + 1)
+				elif distances[w] == infinity:
+					distances[w] = distances[u] + 1
+					queue.append(w)
+		if shortest == infinity:
+			break
 
-		residual_capacity = math.inf
-		self.residual_path = set()
-		while prev_node:
-			edge_capacity = residual_network.adjacency_map[prev_node][curr_node]
-			if edge_capacity < residual_capacity:
-				residual_capacity = edge_capacity
-			self.residual_path.add((prev_node, curr_node))
-			curr_node = prev_node
-			prev_node = residual_network.parents[curr_node]
+		# Vertex disjoint shortest augmenting paths by iterative DFS, each
+		# vertex on the stack pointing at its current edge
+		current = array('q', offsets[:-1])
+		for root in range(n):
+			if match_left[root] != -1:
+				continue
+			stack = [root]
+			while stack:
+				u = stack[-1]
+				if current[u] == offsets[u + 1]:
+					# Dead end
+					distances[u] = infinity
+					stack.pop()
+					if stack:
+						current[stack[-1]] += 1
+					continue
 
-		return residual_capacity
+				v = neighbors[current[u]]
+				w = match_right[v]
+				if w == -1 and distances[u] + 1 == shortest:
+					for x in stack:
+						y = neighbors[current[x]]
+						match_left[x] = y
+						match_right[y] = x
+					break
+				if w != -1 and distances[w] == distances[u] + 1:
+					stack.append(w)
+				else:
+					current[u] += 1
+
+	matching = {left[u]: right[match_left[u] - n] for u in range(n) if match_left[u] != -1}
+
+	# Konig: Z is everything reachable from the free left verticies by
+	# alternating paths, and the cover is the left verticies not in Z plus
+	# the right verticies in Z
+	reached = bytearray(n + len(right))
+	queue = [u for u in range(n) if match_left[u] == -1]
+	for u in queue:
+		reached[u] = 1
+	for u in queue:
+		for v in neighbors[offsets[u]:offsets[u + 1]]:
+			if not reached[v]:
+				reached[v] = 1
+				w = match_right[v]
+				if w != -1 and not reached[w]:
+					reached[w] = 1
+					queue.append(w)
+	cover = set(left[u] for u in range(n) if not reached[u])
+	cover.update(right[v - n] for v in range(n, n + len(right)) if reached[v])
+
+	return matching, cover
 
 
 #V = [1,2,3,4,5,6,7,8,9,10,11]
@@ -648,6 +2943,7 @@ G = FlowNetwork(V, E, source=1, sink=6)
 print(G.max_flow())
 """
 
+"""
 from itertools import product
 V = [s for s in product('abcdefghijklmnopqrstuvwxyz','abcdefghijklmnopqrstuvwxyz',
 	'abcdefghijklmnopqrstuvwxyz','abcdefghijklmnopqrstuvwxyz')]
@@ -655,4 +2951,52 @@ E = []
 for s in V:
 	if 
 
-G = Graph(V, E)
\ No newline at end of file
+G = Graph(V, E)
+"""
+
+def test():
+	# Multiple sources and sinks: the sentinel edges never make the cut
+	G = FlowNetwork(range(3), [(0, 2, 5)], source=[0, 1], sink=[2])
+	assert G.min_cut() == ({0, 1}, [(0, 2)])
+	G = FlowNetwork(range(5), [(0, 2, 3), (1, 2, 4), (2, 3, 5), (2, 4, 1)], source=[0, 1], sink=[3, 4])
+	assert G.max_flow() == 6
+	source_side, cut_edges = G.min_cut()
+	assert source_side == {0, 1, 2} and set(cut_edges) == {(2, 3), (2, 4)}
+
+	# min_cut after min_cost_flow doesn't see the min cost flow's bypass edge
+	G = FlowNetwork(range(3), [(0, 1, 4, 1), (1, 2, 3, 1), (0, 2, 1, 5)], source=0, sink=2)
+	assert G.min_cost_flow() == (4, 11)
+	source_side, cut_edges = G.min_cut()
+	assert source_side == {0, 1} and set(cut_edges) == {(1, 2), (0, 2)}
+
+	# Set operators on a spanning forest give plain sets
+	G = WeightedGraph(range(4), [(0, 1, 1), (1, 2, 2), (0, 2, 3), (2, 3, 1)])
+	forest = G.kruskal()
+	assert forest == {(0, 1, 1), (1, 2, 2), (2, 3, 1)}
+	assert forest | {(0, 2, 3)} == set() | forest | {(0, 2, 3)}
+	assert forest - {(0, 1, 1)} == {(1, 2, 2), (2, 3, 1)}
+	assert forest & {(0, 1, 1), (0, 2, 3)} == {(0, 1, 1)}
+	assert type(forest | set()) is set
+
+	# So do set operators on the edges of a graph with the csr storage
+	G = Graph(range(4), [(0, 1), (1, 2), (2, 3)], is_directed=True, storage='csr')
+	assert G.edges | {(3, 1)} == {(0, 1), (1, 2), (2, 3), (3, 1)}
+	assert {(3, 1)} | G.edges == G.edges | {(3, 1)}
+	assert G.edges - {(0, 1)} == {(1, 2), (2, 3)}
+	assert G.edges & {(0, 1), (3, 1)} == {(0, 1)}
+	assert type(G.edges | set()) is set
+
+	# Both storages drop repeated edges and repeated reverses of undirected ones
+	edges = [(0, 1), (1, 2), (1, 0), (0, 1), (2, 3)]
+	G1 = Graph(range(4), [set(edge) for edge in edges])
+	G2 = Graph(range(4), [set(edge) for edge in edges], storage='csr')
+	G3 = Graph.from_edges(edges)
+	for G in (G2, G3):
+		assert len(G.edges) == len(G1.edges) == 6
+		assert all(len(G.adjacency_map[v]) == len(G1.adjacency_map[v]) for v in range(4))
+	G1 = WeightedGraph(range(3), [(0, 1, 2), (1, 2, 3), (0, 1, 2)], is_directed=True)
+	G2 = WeightedGraph.from_edges([(0, 1, 2), (1, 2, 3), (0, 1, 2)], is_directed=True)
+	assert len(G2.edges) == len(G1.edges) == 2 and set(G2.edges) == G1.edges
+
+if __name__ == '__main__':
+	test()
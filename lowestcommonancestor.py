@@ -0,0 +1,176 @@
+import numpy as np
+
+class SparseTable:
+	"""
+	Range minimum index over a static array: O(n log n) preprocessing, O(1)
+	queries. table[j, i] is the index of the minimum of values[i:i + 2^j],
+	so any range is covered by two (overlapping) windows of the same level.
+	Queries take arrays of ranges and answer all of them at once.
+	"""
+	def __init__(self, values):
+		self.values = values = np.asarray(values)
+		n = len(values)
+		levels = max(1, n.bit_length())
+		self.table = table = np.empty((levels, n), dtype=np.int64)
+		table[0] = np.arange(n)
+		for j in range(1, levels):
+			half = 1 << (j - 1)
+			left, right = table[j - 1, :n - half], table[j - 1, half:]
+			table[j, :n - half] = np.where(values[right] < values[left], right, left)
+			# Windows running past the end are never queried
+			table[j, n - half:] = table[j - 1, n - half:]
+
+	def argmin(self, i, j):
+		"""Index of the minimum of values[i..j] inclusive (i <= j); i and j
+		may be arrays"""
+		i, j = np.asarray(i), np.asarray(j)
+		# Exact floor(log2) of the range lengths
+		level = np.frexp(j - i + 1)[1] - 1
+		left = self.table[level, i]
+		right = self.table[level, j - (1 << level) + 1]
+		return np.where(self.values[right] < self.values[left], right, left)
+
+class LowestCommonAncestor:
+	"""
+	Lowest common ancestor index of the forest given by a parents map (vertex
+	-> parent, None for a root), e.g. Graph.parents after a breadth or depth
+	first search.
+
+	The Euler tour of every tree lists a vertex each time the walk passes
+	through it, so the lowest common ancestor of a and b is the shallowest
+	vertex of the tour between their first occurrences, which a SparseTable
+	of the tour depths finds in O(1). Binary lifting (up[j][v] is the 2^j-th
+	ancestor of v) answers the same queries in O(log depth) and also finds
+	k-th ancestors.
+
+	Verticies get dense ids (their position in 'verticies'); the *_ids
+	methods take and return NumPy arrays of ids, -1 meaning no answer.
+	"""
+	def __init__(self, parents):
+		"""
+		parents - mapping from every vertex of the forest to its parent
+		"""
+		self.verticies = list(parents)
+		self.vertex_to_id = {vertex: i for i, vertex in enumerate(self.verticies)}
+
+		n = len(self.verticies)
+		parent = np.full(n, -1, dtype=np.int64)
+		for i, vertex in enumerate(self.verticies):
+			p = parents[vertex]
+			if p is not None:
+				assert p in self.vertex_to_id, "Parent is not in the map: %s" % (p,)
+				parent[i] = self.vertex_to_id[p]
+
+		self._euler_tour(parent)
+		self.sparse_table = SparseTable(self.depth[self.walk])
+		self._binary_lifting(parent)
+
+	def _euler_tour(self, parent):
+		n = len(parent)
+		# Children of every id in CSR form; roots sort first with parent -1
+		order = np.argsort(parent, kind='stable')
+		number_of_roots = n - np.count_nonzero(parent >= 0)
+		child_offsets = np.zeros(n + 1, dtype=np.int64)
+		np.cumsum(np.bincount(parent[parent >= 0], minlength=n), out=child_offsets[1:])
+		child_offsets = child_offsets.tolist()
+		children = order[number_of_roots:].tolist()
+
+		walk = []
+		first = [-1] * n
+		depth = [0] * n
+		root_of = [-1] * n
+		for root in order[:number_of_roots].tolist():
+			first[root] = len(walk)
+			root_of[root] = root
+			walk.append(root)
+			# (id, index in children of its next child)
+			stack = [(root, child_offsets[root])]
+			while stack:
+				u, k = stack[-1]
+				if k < child_offsets[u + 1]:
+					stack[-1] = (u, k + 1)
+					v = children[k]
+					first[v] = len(walk)
+					depth[v] = depth[u] + 1
+					root_of[v] = root
+					walk.append(v)
+					stack.append((v, child_offsets[v]))
+				else:
+					stack.pop()
+					if stack:
+						walk.append(stack[-1][0])
+
+		assert -1 not in first, "The parents must form a forest"
+		self.walk = np.array(walk, dtype=np.int64)
+		self.first = np.array(first, dtype=np.int64)
+		self.depth = np.array(depth, dtype=np.int64)
+		self.root_of = np.array(root_of, dtype=np.int64)
+
+	def _binary_lifting(self, parent):
+		# Roots are their own parent so lifting past them stays put
+		ancestors = np.where(parent < 0, np.arange(len(parent)), parent)
+		max_depth = int(self.depth.max()) if len(parent) else 0
+		self.up = [ancestors]
+		for j in range(1, max(1, max_depth.bit_length())):
+			self.up.append(self.up[-1][self.up[-1]])
+
+	def _lift(self, ids, steps):
+		for j, ancestors in enumerate(self.up):
+			ids = np.where((steps >> j) & 1, ancestors[ids], ids)
+		return ids
+
+	def query_ids(self, ids1, ids2, algorithm='sparse_table'):
+		"""
+		Lowest common ancestor of every pair (ids1[i], ids2[i]), or -1 if the
+		two are in different trees.
+		algorithm - 'sparse_table' or 'binary_lifting'
+		"""
+		ids1 = np.asarray(ids1, dtype=np.int64)
+		ids2 = np.asarray(ids2, dtype=np.int64)
+		if algorithm == 'sparse_table':
+			first1, first2 = self.first[ids1], self.first[ids2]
+			ancestors = self.walk[self.sparse_table.argmin(np.minimum(first1, first2),
+				np.maximum(first1, first2))]
+		elif algorithm == 'binary_lifting':
+			ancestors = self._binary_lifting_query(ids1, ids2)
+		else:
+			raise ValueError("Unknown algorithm: %s" % (algorithm))
+
+		return np.where(self.root_of[ids1] == self.root_of[ids2], ancestors, -1)
+
+	def _binary_lifting_query(self, ids1, ids2):
+		depth = self.depth
+		# Lift the deeper of each pair to the depth of the other
+		deeper = depth[ids1] < depth[ids2]
+		ids1, ids2 = np.where(deeper, ids2, ids1), np.where(deeper, ids1, ids2)
+		ids1 = self._lift(ids1, depth[ids1] - depth[ids2])
+		# Then lift both to just below their lowest common ancestor
+		for ancestors in reversed(self.up):
+			apart = ancestors[ids1] != ancestors[ids2]
+			ids1 = np.where(apart, ancestors[ids1], ids1)
+			ids2 = np.where(apart, ancestors[ids2], ids2)
+		return np.where(ids1 == ids2, ids1, self.up[0][ids1])
+
+	def query(self, vertex1, vertex2, algorithm='sparse_table'):
+		"""Lowest common ancestor of two verticies, None if there is none"""
+		return self.query_many([vertex1], [vertex2], algorithm)[0]
+
+	def query_many(self, verticies1, verticies2, algorithm='sparse_table'):
+		"""Lowest common ancestor of every pair of verticies, as a list"""
+		ids1 = np.fromiter((self.vertex_to_id[vertex] for vertex in verticies1), dtype=np.int64)
+		ids2 = np.fromiter((self.vertex_to_id[vertex] for vertex in verticies2), dtype=np.int64)
+		assert len(ids1) == len(ids2), "Unequal numbers of verticies"
+		return [None if i < 0 else self.verticies[i]
+			for i in self.query_ids(ids1, ids2, algorithm).tolist()]
+
+	def ancestor_ids(self, ids, k):
+		"""k-th ancestor of every id (k may be an array), -1 if above the root"""
+		ids = np.asarray(ids, dtype=np.int64)
+		k = np.asarray(k, dtype=np.int64)
+		assert (k >= 0).all(), "k must be non-negative"
+		return np.where(k <= self.depth[ids], self._lift(ids, k), -1)
+
+	def ancestor(self, vertex, k):
+		"""The vertex k levels above vertex, None if that is above the root"""
+		i = self.ancestor_ids(self.vertex_to_id[vertex], k).item()
+		return None if i < 0 else self.verticies[i]